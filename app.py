@@ -1,10 +1,28 @@
-from flask import Flask, render_template_string, request, redirect, url_for, jsonify, send_file
+from flask import Flask, Response, render_template_string, request, redirect, url_for, jsonify, send_file
 import random
 import json
 import os
-from datetime import datetime
+import time
+import threading
+import math
+import gzip
+import hashlib
+import heapq
+from datetime import datetime, timedelta
 from io import BytesIO
 import csv
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+from functools import wraps
+from collections import OrderedDict
+from bisect import bisect_left, bisect_right
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is always available
+    brotli = None
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
@@ -13,6 +31,11 @@ app.secret_key = 'your-secret-key-here'
 STUDENTS_FILE = 'students.json'
 HISTORY_FILE = 'group_history.json'
 SETTINGS_FILE = 'settings.json'
+ROLE_HISTORY_FILE = 'role_history.json'
+PICK_HISTORY_FILE = 'pick_history.json'
+ATTENDANCE_FILE = 'attendance.json'
+HISTORY_ARCHIVE_DIR = 'history_archive'
+PROFILE_DIR = 'profiles'
 
 # Available seating areas
 SEATING_AREAS = [
@@ -90,31 +113,1358 @@ def load_students():
             student["absent"] = False
         if "gender" not in student:
             student["gender"] = ""
+        # Roles live in ROLE_COUNTS / current_roles, not on the roster
+        student.pop("role", None)
     
     return data
 
+def save_students():
+    """Save the roster; absences live in the attendance log only"""
+    save_json(STUDENTS_FILE, {
+        "students": [
+            {key: value for key, value in student.items() if key != 'absent'}
+            for student in STUDENTS_DATA['students']
+        ],
+        "restrictions": STUDENTS_DATA['restrictions']
+    })
+
+DEFAULT_SETTINGS = {
+    "group_size": 4,
+    "dark_mode": False,
+    "balance_gender": False,
+    "assign_roles": True,
+    "picker_weighted": True,
+    "picker_no_repeat": False,
+    "history_keep_records": 100,
+    "history_keep_days": 0,
+    "profile_sample_rate": 0,
+    "section_capacity": 0,
+    "password": ""
+}
+
 def load_settings():
     """Load app settings"""
-    default = {
-        "group_size": 4,
-        "dark_mode": False,
-        "balance_gender": False,
-        "assign_roles": True,
-        "password": ""
+    return load_json(SETTINGS_FILE, dict(DEFAULT_SETTINGS))
+
+def role_slots(group_size):
+    """Roles to hand out in a group, cycling GROUP_ROLES for groups larger than the role list"""
+    return [GROUP_ROLES[i % len(GROUP_ROLES)] for i in range(group_size)]
+
+def min_cost_assignment(cost):
+    """Hungarian algorithm on a square cost matrix, returns the column chosen for each row"""
+    n = len(cost)
+    INF = float('inf')
+    u = [0.0] * (n + 1)
+    v = [0.0] * (n + 1)
+    match = [0] * (n + 1)  # match[col] = row (1-based, 0 = free)
+    way = [0] * (n + 1)
+    
+    for row in range(1, n + 1):
+        match[0] = row
+        col0 = 0
+        minv = [INF] * (n + 1)
+        used = [False] * (n + 1)
+        while True:
+            used[col0] = True
+            row0 = match[col0]
+            delta = INF
+            col1 = 0
+            for col in range(1, n + 1):
+                if not used[col]:
+                    cur = cost[row0 - 1][col - 1] - u[row0] - v[col]
+                    if cur < minv[col]:
+                        minv[col] = cur
+                        way[col] = col0
+                    if minv[col] < delta:
+                        delta = minv[col]
+                        col1 = col
+            for col in range(n + 1):
+                if used[col]:
+                    u[match[col]] += delta
+                    v[col] -= delta
+                else:
+                    minv[col] -= delta
+            col0 = col1
+            if match[col0] == 0:
+                break
+        # Walk the augmenting path back
+        while col0:
+            col1 = way[col0]
+            match[col0] = match[col1]
+            col0 = col1
+    
+    result = [0] * n
+    for col in range(1, n + 1):
+        result[match[col] - 1] = col - 1
+    return result
+
+def assign_roles(groups, role_counts):
+    """Give each member the role they have held least, return {name: role} and update role_counts"""
+    roles = {}
+    for group in groups:
+        if not group:
+            continue
+        slots = role_slots(len(group))
+        # Small random jitter (summing to < 1) only breaks ties between equal counts
+        jitter = 1.0 / (len(group) + 1)
+        cost = [
+            [role_counts.get(m['name'], {}).get(role, 0) + random.random() * jitter for role in slots]
+            for m in group
+        ]
+        for member, slot in zip(group, min_cost_assignment(cost)):
+            role = slots[slot]
+            roles[member['name']] = role
+            counts = role_counts.setdefault(member['name'], {})
+            counts[role] = counts.get(role, 0) + 1
+    return roles
+
+# Grouping optimizer. Restrictions (pairs of names that shouldn't share a
+# group) and gender balance on big cohorts are solved with randomized
+# restarts of a swap-based local search, spread over a process pool when
+# the cohort is large. Students are passed to workers as plain indices.
+SOLVER_BUDGET_SECONDS = 1.0
+SOLVER_PARALLEL_MIN = 60  # smaller cohorts run their restarts in-process
+RESTRICTION_PENALTY = 1000
+solver_pool = None
+solver_pool_lock = threading.Lock()
+
+def gender_code(gender):
+    """Normalize 'M'/'male'/'F'/'female' style values to one letter"""
+    return gender[:1].upper() if gender else ''
+
+def group_penalty(members, genders, conflicts, targets):
+    """Restriction violations plus how far each gender count falls outside its fair range"""
+    penalty = 0
+    for pos, i in enumerate(members):
+        for j in members[pos + 1:]:
+            if j in conflicts[i]:
+                penalty += RESTRICTION_PENALTY
+    if targets:
+        counts = {}
+        for i in members:
+            counts[genders[i]] = counts.get(genders[i], 0) + 1
+        for code, (low, high) in targets.items():
+            count = counts.get(code, 0)
+            if count < low:
+                penalty += (low - count) ** 2
+            elif count > high:
+                penalty += (count - high) ** 2
+    return penalty
+
+def local_search(rng, buckets, genders, conflicts, targets, deadline):
+    """Swap members between buckets while it doesn't hurt, returns the total penalty.
+    The last bucket holds the leftover students and is not scored."""
+    scored = len(buckets) - 1
+    penalties = [group_penalty(b, genders, conflicts, targets) for b in buckets[:scored]] + [0]
+    total = sum(penalties)
+    stale = 0
+    stale_limit = 20 * len(genders)
+    steps = 0
+    
+    while total > 0 and stale < stale_limit:
+        steps += 1
+        if steps % 256 == 0 and time.time() >= deadline:
+            break
+        a = rng.randrange(len(buckets))
+        b = rng.randrange(len(buckets))
+        if a == b or not buckets[a] or not buckets[b] or penalties[a] + penalties[b] == 0:
+            stale += 1
+            continue
+        
+        x = rng.randrange(len(buckets[a]))
+        y = rng.randrange(len(buckets[b]))
+        buckets[a][x], buckets[b][y] = buckets[b][y], buckets[a][x]
+        new_a = group_penalty(buckets[a], genders, conflicts, targets) if a < scored else 0
+        new_b = group_penalty(buckets[b], genders, conflicts, targets) if b < scored else 0
+        delta = new_a + new_b - penalties[a] - penalties[b]
+        
+        if delta <= 0:
+            # Sideways moves are kept to walk across plateaus
+            stale = 0 if delta < 0 else stale + 1
+            penalties[a], penalties[b] = new_a, new_b
+            total += delta
+        else:
+            buckets[a][x], buckets[b][y] = buckets[b][y], buckets[a][x]
+            stale += 1
+    return total
+
+def solver_restarts(seed, sizes, genders, conflicts, targets, deadline):
+    """Run restarts until the deadline or a perfect grouping, returns (penalty, buckets)"""
+    rng = random.Random(seed)
+    best_penalty, best_buckets = math.inf, None
+    while True:
+        order = list(range(len(genders)))
+        rng.shuffle(order)
+        buckets = []
+        start = 0
+        for size in sizes:
+            buckets.append(order[start:start + size])
+            start += size
+        
+        penalty = local_search(rng, buckets, genders, conflicts, targets, deadline)
+        if penalty < best_penalty:
+            best_penalty, best_buckets = penalty, buckets
+        if best_penalty == 0 or time.time() >= deadline:
+            return best_penalty, best_buckets
+
+def get_solver_pool(workers):
+    """Process pool shared by all optimizer runs, created on first use"""
+    global solver_pool
+    # Request threads and the pre-generation thread both get here
+    with solver_pool_lock:
+        if solver_pool is None:
+            solver_pool = ProcessPoolExecutor(max_workers=workers)
+    return solver_pool
+
+def solver_inputs(present_students, settings, restrictions):
+    """Index-based (genders, conflicts, targets) used to score groupings"""
+    group_size = settings['group_size']
+    num_groups = len(present_students) // group_size
+    index = {s['name']: i for i, s in enumerate(present_students)}
+    conflicts = [set() for _ in present_students]
+    for pair in restrictions:
+        if len(pair) == 2 and pair[0] in index and pair[1] in index:
+            a, b = index[pair[0]], index[pair[1]]
+            conflicts[a].add(b)
+            conflicts[b].add(a)
+    
+    genders = [gender_code(s.get('gender', '')) for s in present_students]
+    targets = {}
+    if settings['balance_gender'] and num_groups:
+        # Every group should hold floor/ceil of its fair share of each gender
+        for code in set(genders) - {''}:
+            share = genders.count(code) * group_size / len(present_students)
+            targets[code] = (math.floor(share), math.ceil(share))
+    return genders, conflicts, targets
+
+def grouping_penalty(groups, present_students, settings, restrictions):
+    """Score a finished grouping the same way the optimizer does (0 is perfect)"""
+    genders, conflicts, targets = solver_inputs(present_students, settings, restrictions)
+    index = {s['name']: i for i, s in enumerate(present_students)}
+    return sum(
+        group_penalty([index[m['name']] for m in group], genders, conflicts, targets)
+        for group in groups
+    )
+
+def optimize_groups(present_students, settings, restrictions):
+    """Best grouping found within the solver budget, returns (groups, remaining names)"""
+    group_size = settings['group_size']
+    num_groups = len(present_students) // group_size
+    sizes = [group_size] * num_groups + [len(present_students) - num_groups * group_size]
+    genders, conflicts, targets = solver_inputs(present_students, settings, restrictions)
+    
+    deadline = time.time() + settings.get('solver_budget', SOLVER_BUDGET_SECONDS)
+    workers = settings.get('solver_workers') or os.cpu_count() or 1
+    args = (sizes, genders, conflicts, targets, deadline)
+    if workers > 1 and len(present_students) >= SOLVER_PARALLEL_MIN:
+        pool = get_solver_pool(workers)
+        futures = [pool.submit(solver_restarts, random.getrandbits(64), *args) for _ in range(workers)]
+        results = [future.result() for future in futures]
+    else:
+        results = [solver_restarts(random.getrandbits(64), *args)]
+    
+    penalty, buckets = min(results, key=lambda result: result[0])
+    groups = [[present_students[i] for i in bucket] for bucket in buckets[:-1]]
+    remaining = [present_students[i]['name'] for i in buckets[-1]]
+    return groups, remaining
+
+def needs_optimizer(present_students, settings, restrictions):
+    """Restrictions among present students, or gender balancing on a big cohort"""
+    if restrictions:
+        present = {s['name'] for s in present_students}
+        if any(len(pair) == 2 and pair[0] in present and pair[1] in present for pair in restrictions):
+            return True
+    return settings['balance_gender'] and len(present_students) >= SOLVER_PARALLEL_MIN and \
+        any(s.get('gender') for s in present_students)
+
+def build_groups(present_students, settings, role_counts, restrictions=()):
+    """Shuffle students into groups, returns (groups, remaining names, roles, seating)"""
+    # Shuffle students
+    shuffled = list(present_students)
+    random.shuffle(shuffled)
+    
+    group_size = settings['group_size']
+    num_groups = len(shuffled) // group_size
+    groups = []
+    
+    if needs_optimizer(shuffled, settings, restrictions):
+        groups, remaining = optimize_groups(shuffled, settings, restrictions)
+    # Balance by gender if enabled
+    elif settings['balance_gender'] and any(s['gender'] for s in shuffled):
+        # Separate by gender
+        males = [s for s in shuffled if s.get('gender') == 'M']
+        females = [s for s in shuffled if s.get('gender') == 'F']
+        others = [s for s in shuffled if not s.get('gender')]
+        
+        random.shuffle(males)
+        random.shuffle(females)
+        random.shuffle(others)
+        
+        # Distribute evenly
+        for i in range(num_groups):
+            group = []
+            # Add from each gender pool
+            if males:
+                group.append(males.pop())
+            if females:
+                group.append(females.pop())
+            if males and len(group) < group_size:
+                group.append(males.pop())
+            if females and len(group) < group_size:
+                group.append(females.pop())
+            
+            # Fill remaining spots
+            while len(group) < group_size and (males or females or others):
+                if males:
+                    group.append(males.pop())
+                elif females:
+                    group.append(females.pop())
+                elif others:
+                    group.append(others.pop())
+            
+            groups.append(group)
+        
+        remaining = [s['name'] for s in males + females + others]
+    else:
+        # Regular grouping
+        for i in range(num_groups):
+            group = shuffled[i*group_size:(i+1)*group_size]
+            groups.append(group)
+        
+        remaining = [s['name'] for s in shuffled[num_groups*group_size:]]
+    
+    # Assign roles if enabled, rotating towards the roles each student has held least
+    if settings['assign_roles']:
+        roles = assign_roles(groups, role_counts)
+    else:
+        roles = {}
+    
+    # Assign seating
+    available_seats = SEATING_AREAS.copy()
+    random.shuffle(available_seats)
+    seating = available_seats[:num_groups]
+    
+    return groups, remaining, roles, seating
+
+def split_sections(students, capacity, group_size, restrictions=()):
+    """Deal students into the fewest sections that fit the room capacity.
+    Sections hold whole groups (counts differing by at most one) so only the
+    global remainder is left ungrouped. Students with restrictions are dealt
+    first, most restricted first, each into the section holding the fewest of
+    their partners, so every section can still keep them apart. Everyone goes
+    where their gender is least represented, so each section gets about its
+    share of each. Sections are kept in heaps, so this runs in
+    O((students + restrictions) * log(sections))."""
+    num_groups = len(students) // group_size
+    groups_per_room = max(1, capacity // group_size)
+    count = max(1, math.ceil(len(students) / capacity), math.ceil(num_groups / groups_per_room))
+    
+    sizes = [(num_groups // count + (1 if i < num_groups % count else 0)) * group_size for i in range(count)]
+    random.shuffle(sizes)
+    extra = len(students) - sum(sizes)
+    for i in range(count):
+        fits = min(extra, max(0, capacity - sizes[i]))
+        sizes[i] += fits
+        extra -= fits
+    sizes[-1] += extra  # only when capacity is smaller than one group
+    
+    present = {s['name'] for s in students}
+    partners = {}
+    for pair in restrictions:
+        if len(pair) == 2 and pair[0] in present and pair[1] in present:
+            partners.setdefault(pair[0], set()).add(pair[1])
+            partners.setdefault(pair[1], set()).add(pair[0])
+    
+    order = list(students)
+    random.shuffle(order)
+    order.sort(key=lambda s: -len(partners.get(s['name'], ())))
+    
+    # One heap of sections per gender, best first by (share of that gender,
+    # fill). Entries go stale when their section changes (stamp) or fills up
+    # and are dropped lazily when popped.
+    sections = [[] for _ in range(count)]
+    genders = [{} for _ in range(count)]
+    stamps = [0] * count
+    codes = {gender_code(s.get('gender', '')) for s in students}
+    
+    def entry(i, code):
+        return ((genders[i].get(code, 0) + 1) / sizes[i], len(sections[i]) / sizes[i], random.random(), stamps[i], i)
+    
+    heaps = {code: [entry(i, code) for i in range(count) if sizes[i]] for code in codes}
+    for heap in heaps.values():
+        heapq.heapify(heap)
+    
+    placed = {}  # {name: section}
+    for student in order:
+        code = gender_code(student.get('gender', ''))
+        clashes = {}
+        for partner in partners.get(student['name'], ()):
+            if partner in placed:
+                clashes[placed[partner]] = clashes.get(placed[partner], 0) + 1
+        
+        # Best section without a partner in it, setting aside those that have one
+        heap = heaps[code]
+        skipped = []
+        position = None
+        while heap:
+            item = heapq.heappop(heap)
+            i = item[-1]
+            if item[-2] != stamps[i] or len(sections[i]) >= sizes[i]:
+                continue
+            if clashes.get(i):
+                skipped.append(item)
+                continue
+            position = i
+            break
+        if position is None:
+            # Every section with room holds a partner: fewest clashes wins
+            position = min(skipped, key=lambda item: (clashes[item[-1]], item))[-1]
+        for item in skipped:
+            heapq.heappush(heap, item)
+        
+        sections[position].append(student)
+        genders[position][code] = genders[position].get(code, 0) + 1
+        placed[student['name']] = position
+        stamps[position] += 1
+        if len(sections[position]) < sizes[position]:
+            for other in codes:
+                heapq.heappush(heaps[other], entry(position, other))
+    return sections
+
+def build_cohort(present_students, settings, role_counts, restrictions=()):
+    """Like build_groups, but first splits into sections when section_capacity applies.
+    Returns (groups, remaining names, roles, seating, sections, remaining sections)
+    where sections holds each group's section number and remaining sections
+    each remaining student's, both empty for a flat grouping."""
+    capacity = settings.get('section_capacity', 0)
+    if not capacity or len(present_students) <= capacity:
+        return build_groups(present_students, settings, role_counts, restrictions) + ([], [])
+    
+    parts = split_sections(present_students, capacity, settings['group_size'], restrictions)
+    # Sections share one optimizer budget so latency stays bounded
+    budget = settings.get('solver_budget', SOLVER_BUDGET_SECONDS) / len(parts)
+    section_settings = dict(settings, solver_budget=budget)
+    
+    groups, remaining, roles, seating, sections, remaining_sections = [], [], {}, [], [], []
+    for number, part in enumerate(parts):
+        part_groups, part_remaining, part_roles, part_seating = build_groups(
+            part, section_settings, role_counts, restrictions
+        )
+        groups.extend(part_groups)
+        remaining.extend(part_remaining)
+        roles.update(part_roles)
+        # Each section is its own room, so seats repeat between sections
+        seating.extend(part_seating + [""] * (len(part_groups) - len(part_seating)))
+        sections.extend([number] * len(part_groups))
+        remaining_sections.extend([number] * len(part_remaining))
+    return groups, remaining, roles, seating, sections, remaining_sections
+
+class FenwickTree:
+    """Binary indexed tree over weights: O(log n) updates, totals and weighted sampling"""
+    
+    def __init__(self, weights):
+        self.n = len(weights)
+        self.weights = list(weights)
+        self.tree = [0.0] * (self.n + 1)
+        # O(n) build: push each node's sum up to its parent
+        for i, weight in enumerate(self.weights, 1):
+            self.tree[i] += weight
+            parent = i + (i & -i)
+            if parent <= self.n:
+                self.tree[parent] += self.tree[i]
+    
+    def update(self, index, weight):
+        """Set the weight at a 0-based index"""
+        delta = weight - self.weights[index]
+        self.weights[index] = weight
+        i = index + 1
+        while i <= self.n:
+            self.tree[i] += delta
+            i += i & -i
+    
+    def total(self):
+        """Sum of all weights"""
+        result = 0.0
+        i = self.n
+        while i > 0:
+            result += self.tree[i]
+            i -= i & -i
+        return result
+    
+    def find(self, target):
+        """0-based index of the first item whose running weight sum exceeds target"""
+        pos = 0
+        step = 1 << self.n.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= self.n and self.tree[nxt] <= target:
+                pos = nxt
+                target -= self.tree[nxt]
+            step >>= 1
+        return min(pos, self.n - 1)
+    
+    def sample(self):
+        """Random 0-based index with probability proportional to its weight"""
+        index = self.find(random.random() * self.total())
+        if self.weights[index] <= 0:
+            # Float drift landed on an exhausted slot, fall back to any live one
+            index = next(i for i, w in enumerate(self.weights) if w > 0)
+        return index
+
+# Attendance log: for every date, a bitset of enrolled students and one of
+# present students, one bit per student id. Ids are handed out once per name
+# and never reused, so old dates stay readable after students are removed.
+# This log is the only persisted record of who is absent: students.json is
+# saved without the absent flags, and a day with no changes is still logged
+# by ensure_attendance_day().
+
+def today():
+    return datetime.now().strftime("%Y-%m-%d")
+
+def load_attendance():
+    """Load the attendance log, bitsets as ints"""
+    data = load_json(ATTENDANCE_FILE, {"ids": {}, "next_id": 0, "days": {}})
+    return {
+        "ids": data["ids"],
+        "next_id": data["next_id"],
+        "days": {
+            day: {"roster": int(bits["roster"], 16), "present": int(bits["present"], 16)}
+            for day, bits in data["days"].items()
+        }
+    }
+
+def save_attendance():
+    """Save the attendance log, bitsets as hex strings"""
+    save_json(ATTENDANCE_FILE, {
+        "ids": ATTENDANCE["ids"],
+        "next_id": ATTENDANCE["next_id"],
+        "days": {
+            day: {"roster": format(bits["roster"], 'x'), "present": format(bits["present"], 'x')}
+            for day, bits in ATTENDANCE["days"].items()
+        }
+    })
+
+def attendance_bit(name):
+    """Bit mask for a student, handing out a new id on first sight"""
+    if name not in ATTENDANCE["ids"]:
+        ATTENDANCE["ids"][name] = ATTENDANCE["next_id"]
+        ATTENDANCE["next_id"] += 1
+    return 1 << ATTENDANCE["ids"][name]
+
+def record_attendance():
+    """Write today's bitsets from the live absent flags"""
+    roster = present = 0
+    for student in STUDENTS_DATA['students']:
+        bit = attendance_bit(student['name'])
+        roster |= bit
+        if not student['absent']:
+            present |= bit
+    ATTENDANCE["days"][today()] = {"roster": roster, "present": present}
+
+def today_attendance():
+    """Today's bitsets, started from the live flags on the first change of the day"""
+    if today() not in ATTENDANCE["days"]:
+        record_attendance()
+    return ATTENDANCE["days"][today()]
+
+def set_present(name, present):
+    """Flip one student's bit for today"""
+    day = today_attendance()
+    bit = attendance_bit(name)
+    day["roster"] |= bit
+    if present:
+        day["present"] |= bit
+    else:
+        day["present"] &= ~bit
+
+def apply_attendance():
+    """Restore the absent flags from the latest logged day after a restart"""
+    logged = [day for day in ATTENDANCE["days"] if day <= today()]
+    if not logged:
+        return
+    day = ATTENDANCE["days"][max(logged)]
+    for student in STUDENTS_DATA['students']:
+        sid = ATTENDANCE["ids"].get(student['name'])
+        if sid is not None and day["roster"] >> sid & 1:
+            student['absent'] = not day["present"] >> sid & 1
+
+def ensure_attendance_day():
+    """Log today's bitsets if nothing has been recorded yet today"""
+    if today() not in ATTENDANCE["days"]:
+        record_attendance()
+        save_attendance()
+
+def attendance_stats(start, end, names):
+    """{name: {"present", "sessions", "rate"}} over the dates start..end (inclusive)"""
+    days = [bits for day, bits in ATTENDANCE["days"].items() if start <= day <= end]
+    stats = {}
+    for name in names:
+        sid = ATTENDANCE["ids"].get(name)
+        sessions = present = 0
+        if sid is not None:
+            sessions = sum(bits["roster"] >> sid & 1 for bits in days)
+            present = sum(bits["present"] >> sid & 1 for bits in days)
+        stats[name] = {
+            "present": present,
+            "sessions": sessions,
+            "rate": round(present / sessions, 3) if sessions else None
+        }
+    return stats
+
+# History retention: records outside the hot window (last N records and/or
+# last X days) are rolled into gzip-compressed archive segments. Segments are
+# written once and never changed; history_archive/index.json lists them with
+# their date range so queries only open the segments they need.
+ARCHIVE_SEGMENT_MIN = 50  # don't cut segments smaller than this
+
+def load_archive_index():
+    path = os.path.join(HISTORY_ARCHIVE_DIR, 'index.json')
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return []
+
+def recover_archive():
+    """Finish an archive_history() that was interrupted before index.json was saved"""
+    if not os.path.isdir(HISTORY_ARCHIVE_DIR):
+        return
+    listed = {segment['file'] for segment in ARCHIVE_INDEX}
+    for name in sorted(os.listdir(HISTORY_ARCHIVE_DIR)):
+        path = os.path.join(HISTORY_ARCHIVE_DIR, name)
+        if name.endswith('.tmp'):
+            # A segment write that never finished; its records are still hot
+            os.remove(path)
+            continue
+        if not name.startswith('segment-') or name in listed:
+            continue
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                segment = json.load(f)
+        except (OSError, EOFError, ValueError):
+            print(f"⚠️ Removing unreadable archive segment {name}", file=sys.stderr)
+            os.remove(path)
+            continue
+        if not segment or HISTORY[:len(segment)] == segment:
+            # The hot file was never trimmed, its records are still there
+            os.remove(path)
+            continue
+        ARCHIVE_INDEX.append({
+            "file": name,
+            "first": segment[0]['date'],
+            "last": segment[-1]['date'],
+            "count": len(segment)
+        })
+        save_json(os.path.join(HISTORY_ARCHIVE_DIR, 'index.json'), ARCHIVE_INDEX)
+
+def archive_history():
+    """Move cold records from HISTORY into a new segment and save both, returns True if any moved"""
+    keep = SETTINGS.get('history_keep_records', 100)
+    days = SETTINGS.get('history_keep_days', 0)
+    if not keep and not days:
+        return False
+    
+    # A record stays hot if it is inside either configured window
+    cold = len(HISTORY) - keep if keep else len(HISTORY)
+    if days:
+        cutoff = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+        older = next((i for i, record in enumerate(HISTORY) if record['date'] >= cutoff), len(HISTORY))
+        cold = min(cold, older) if keep else older
+    if cold < ARCHIVE_SEGMENT_MIN:
+        return False
+    
+    segment = HISTORY[:cold]
+    name = f"segment-{len(ARCHIVE_INDEX):05d}.json.gz"
+    os.makedirs(HISTORY_ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(HISTORY_ARCHIVE_DIR, name)
+    with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as f:
+        json.dump(segment, f, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+    # Trim the hot file before listing the segment, recover_archive() handles
+    # a crash between any two of these writes
+    del HISTORY[:cold]
+    save_json(HISTORY_FILE, HISTORY)
+    ARCHIVE_INDEX.append({
+        "file": name,
+        "first": segment[0]['date'],
+        "last": segment[-1]['date'],
+        "count": len(segment)
+    })
+    save_json(os.path.join(HISTORY_ARCHIVE_DIR, 'index.json'), ARCHIVE_INDEX)
+    return True
+
+def history_record(timestamp, groups, group_size, sections):
+    """History entry for one grouping, shared by the web app and batch mode"""
+    record = {
+        "date": timestamp,
+        "num_groups": len(groups),
+        "group_size": group_size,
+        "groups": [[m['name'] for m in g] for g in groups]
     }
-    return load_json(SETTINGS_FILE, default)
+    if sections:
+        record["num_sections"] = max(sections) + 1
+        record["group_sections"] = list(sections)
+    return record
 
-# Load data
-STUDENTS_DATA = load_students()
-HISTORY = load_json(HISTORY_FILE, [])
-SETTINGS = load_settings()
+def history_records(start='', end='\uffff'):
+    """Every history record dated start..end, archived segments first, oldest first"""
+    for segment in ARCHIVE_INDEX:
+        if segment['last'] < start or segment['first'] > end:
+            continue
+        with gzip.open(os.path.join(HISTORY_ARCHIVE_DIR, segment['file']), 'rt', encoding='utf-8') as f:
+            for record in json.load(f):
+                if start <= record['date'] <= end:
+                    yield record
+    for record in HISTORY:
+        if start <= record['date'] <= end:
+            yield record
+
+# App data, filled in by init_app_state() before the first request so that
+# importing this module (batch mode, process pool workers) touches no files
+STUDENTS_DATA = {"students": [], "restrictions": []}
+HISTORY = []
+SETTINGS = dict(DEFAULT_SETTINGS)
+ROLE_COUNTS = {}  # {name: {role: times held}}
+PICK_COUNTS = {}  # {name: times picked}
+ATTENDANCE = {"ids": {}, "next_id": 0, "days": {}}
+ARCHIVE_INDEX = []
 
 # Store current groups
 current_groups = []
 current_seating = []
+current_sections = []  # section number of each group, empty when not sectioned
 current_remaining = []
+current_remaining_sections = []  # section number of each remaining student, empty when not sectioned
+current_roles = {}
 current_timestamp = ""
 
+# Rendered index page cache. Every change to STUDENTS_DATA, SETTINGS or the
+# current groups bumps STATE_VERSION and empties the cache. Pages are keyed by
+# the version read before rendering, so a render that raced a change is
+# stored under the old version and never served again. That only holds if
+# the bump is the last step of a change, after record_version() (undo/redo
+# buttons) and everything else the page shows.
+STATE_VERSION = 0
+PAGE_CACHE = {}  # {(version, message): {"etag": ..., "bodies": {encoding: bytes}}}
+PAGE_CACHE_MAX = 32
+
+def mark_state_changed():
+    """Invalidate everything rendered from the previous state"""
+    global STATE_VERSION
+    STATE_VERSION += 1
+    PAGE_CACHE.clear()
+
+def negotiate_encoding():
+    """Best response encoding the client accepts"""
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return 'identity'
+
+def compress_body(body, encoding):
+    """Compress a response body for the given content encoding"""
+    if encoding == 'br':
+        return brotli.compress(body)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+# Live updates: asgi.py flips LIVE_UPDATES and registers a listener that
+# pushes groups_payload() to every connected /events stream
+LIVE_UPDATES = False
+GROUP_LISTENERS = []
+
+def groups_payload():
+    """Current grouping as plain JSON-ready data"""
+    return {
+        "timestamp": current_timestamp,
+        "group_size": SETTINGS['group_size'],
+        "groups": [
+            {
+                "seating": current_seating[i] if i < len(current_seating) else "",
+                "section": current_sections[i] if i < len(current_sections) else None,
+                "members": [
+                    {"name": m['name'], "gender": m.get('gender', ''), "role": current_roles.get(m['name'], '')}
+                    for m in group
+                ]
+            }
+            for i, group in enumerate(current_groups)
+        ],
+        "remaining": current_remaining
+    }
+
+def notify_group_listeners():
+    """Hand the new grouping to any registered live-update listeners"""
+    if not GROUP_LISTENERS:
+        return
+    payload = groups_payload()
+    for listener in GROUP_LISTENERS:
+        listener(payload)
+
+# Random picker state (rebuilt lazily after roster or settings changes)
+picker_names = []
+picker_tree = None
+picked_this_round = set()
+
+def pick_weight(name):
+    """Picker weight for a student: less often picked means more likely"""
+    if SETTINGS.get('picker_no_repeat') and name in picked_this_round:
+        return 0.0
+    if SETTINGS.get('picker_weighted', True):
+        return 1.0 / (1 + PICK_COUNTS.get(name, 0))
+    return 1.0
+
+def build_picker():
+    """Rebuild the picker tree over present students"""
+    global picker_names, picker_tree
+    picker_names = [s['name'] for s in STUDENTS_DATA['students'] if not s['absent']]
+    picker_tree = FenwickTree([pick_weight(name) for name in picker_names])
+
+def invalidate_picker():
+    """Drop the picker tree so the next pick sees the current roster and settings"""
+    global picker_tree
+    picker_tree = None
+
+def draw_student():
+    """Pick a present student in O(log n), or None if nobody is present"""
+    if picker_tree is None:
+        build_picker()
+    if not picker_names:
+        return None
+    if picker_tree.total() <= 0:
+        # Everyone has been picked this round, start a new one
+        picked_this_round.clear()
+        build_picker()
+    
+    index = picker_tree.sample()
+    name = picker_names[index]
+    PICK_COUNTS[name] = PICK_COUNTS.get(name, 0) + 1
+    picked_this_round.add(name)
+    picker_tree.update(index, pick_weight(name))
+    return name
+
+# Roster search index: names sorted case-insensitively for prefix lookups
+# with bisect, plus a trigram index for substring lookups. Only add, remove
+# and undo/redo change which students exist, so only they invalidate it;
+# the filters read the live student records.
+STUDENTS_PER_PAGE = 50
+roster_index = None
+
+def invalidate_roster_index():
+    global roster_index
+    roster_index = None
+
+def get_roster_index():
+    """Search index for the current roster, rebuilt on first use after a change"""
+    global roster_index
+    if roster_index is None:
+        ordered = sorted((s['name'].lower(), s['name']) for s in STUDENTS_DATA['students'])
+        trigrams = {}
+        for key, name in ordered:
+            for i in range(len(key) - 2):
+                trigrams.setdefault(key[i:i + 3], set()).add(name)
+        roster_index = {
+            "keys": [key for key, _ in ordered],
+            "names": [name for _, name in ordered],
+            "trigrams": trigrams,
+            "students": {s['name']: s for s in STUDENTS_DATA['students']}
+        }
+    return roster_index
+
+def search_students(query='', match='prefix', gender='', absent='', notes=''):
+    """Students matching a name query and filters, in name order"""
+    index = get_roster_index()
+    query = query.strip().lower()
+    if not query:
+        names = index['names']
+    elif match == 'contains' and len(query) >= 3:
+        # Intersect trigram postings smallest first, then confirm the substring
+        postings = sorted((index['trigrams'].get(query[i:i + 3], set()) for i in range(len(query) - 2)), key=len)
+        hits = set.intersection(*postings)
+        names = sorted((n for n in hits if query in n.lower()), key=lambda n: (n.lower(), n))
+    elif match == 'contains':
+        names = [name for key, name in zip(index['keys'], index['names']) if query in key]
+    else:
+        low = bisect_left(index['keys'], query)
+        high = bisect_left(index['keys'], query + '\uffff', low)
+        names = index['names'][low:high]
+    
+    students = [index['students'][name] for name in names]
+    if gender:
+        students = [s for s in students if gender_code(s.get('gender', '')) == gender]
+    if absent:
+        students = [s for s in students if s['absent'] == (absent == '1')]
+    if notes:
+        students = [s for s in students if bool(s.get('notes')) == (notes == '1')]
+    return students
+
+def render_student_list(students, page, per_page=STUDENTS_PER_PAGE):
+    """Render one page of student cards"""
+    page = max(1, page)
+    start = (page - 1) * per_page
+    shown = students[start:start + per_page]
+    return render_template_string(
+        STUDENT_LIST_TEMPLATE,
+        students=shown,
+        page=page,
+        per_page=per_page,
+        total=len(students),
+        first=start + 1 if shown else 0,
+        last=start + len(shown)
+    )
+
+# Undo/redo: VERSIONS holds immutable snapshots of the roster, the current
+# groups and the role counts, VERSION_INDEX points at the one on screen. Snapshots share every
+# unchanged chunk, record and grouping with the previous one, so a new
+# version only costs what actually changed.
+VERSION_LIMIT = 200
+SNAPSHOT_CHUNK = 32
+VERSIONS = []
+VERSION_INDEX = -1
+
+def share(new, old):
+    """Reuse the old immutable value when nothing changed"""
+    return old if new == old else new
+
+def freeze_roster(students, previous):
+    """Roster as a tuple of chunks of frozen student records"""
+    previous_records = None
+    chunks = []
+    for start in range(0, len(students), SNAPSHOT_CHUNK):
+        chunk = tuple(tuple(sorted(s.items())) for s in students[start:start + SNAPSHOT_CHUNK])
+        index = start // SNAPSHOT_CHUNK
+        if index < len(previous) and previous[index] == chunk:
+            chunk = previous[index]
+        else:
+            # Chunk changed (or shifted), still share the individual records
+            if previous_records is None:
+                previous_records = {record: record for old in previous for record in old}
+            chunk = tuple(previous_records.get(record, record) for record in chunk)
+        chunks.append(chunk)
+    return tuple(chunks)
+
+def freeze_role_counts(previous):
+    """ROLE_COUNTS as a sorted tuple of (name, roles), sharing unchanged entries"""
+    previous_entries = dict(previous)
+    frozen = []
+    for name in sorted(ROLE_COUNTS):
+        roles = tuple(sorted(ROLE_COUNTS[name].items()))
+        old = previous_entries.get(name)
+        frozen.append((name, old if old == roles else roles))
+    return tuple(frozen)
+
+def take_snapshot(label):
+    """Immutable snapshot of the roster and current groups"""
+    previous = VERSIONS[VERSION_INDEX] if VERSIONS else {
+        "roster": (), "restrictions": (), "groups": (), "seating": (), "sections": (), "remaining": (),
+        "remaining_sections": (), "roles": (), "role_counts": ()
+    }
+    return {
+        "label": label,
+        "roster": share(freeze_roster(STUDENTS_DATA['students'], previous['roster']), previous['roster']),
+        "restrictions": share(tuple(tuple(pair) for pair in STUDENTS_DATA.get('restrictions', [])), previous['restrictions']),
+        "groups": share(tuple(tuple(m['name'] for m in group) for group in current_groups), previous['groups']),
+        "seating": share(tuple(current_seating), previous['seating']),
+        "sections": share(tuple(current_sections), previous['sections']),
+        "remaining": share(tuple(current_remaining), previous['remaining']),
+        "remaining_sections": share(tuple(current_remaining_sections), previous['remaining_sections']),
+        "roles": share(tuple(sorted(current_roles.items())), previous['roles']),
+        "role_counts": share(freeze_role_counts(previous['role_counts']), previous['role_counts']),
+        "timestamp": current_timestamp
+    }
+
+def record_version(label):
+    """Snapshot the state after a change, dropping any redo branch"""
+    global VERSION_INDEX
+    snapshot = take_snapshot(label)
+    del VERSIONS[VERSION_INDEX + 1:]
+    VERSIONS.append(snapshot)
+    if len(VERSIONS) > VERSION_LIMIT:
+        del VERSIONS[0]
+    VERSION_INDEX = len(VERSIONS) - 1
+
+def switch_version(index):
+    """Make VERSIONS[index] the live state"""
+    global VERSION_INDEX, current_groups, current_seating, current_sections, current_remaining, current_remaining_sections
+    global current_roles, current_timestamp
+    snapshot = VERSIONS[index]
+    roster_changed = snapshot['roster'] is not VERSIONS[VERSION_INDEX]['roster'] or \
+        snapshot['restrictions'] is not VERSIONS[VERSION_INDEX]['restrictions']
+    role_counts_changed = snapshot['role_counts'] is not VERSIONS[VERSION_INDEX]['role_counts']
+    VERSION_INDEX = index
+    
+    if roster_changed:
+        STUDENTS_DATA['students'] = [dict(record) for chunk in snapshot['roster'] for record in chunk]
+        STUDENTS_DATA['restrictions'] = [list(pair) for pair in snapshot['restrictions']]
+        save_students()
+        record_attendance()
+        save_attendance()
+        invalidate_roster_index()
+        invalidate_picker()
+        invalidate_pregenerated()
+    
+    if role_counts_changed:
+        # Undoing a generate also undoes the roles it handed out
+        ROLE_COUNTS.clear()
+        ROLE_COUNTS.update((name, dict(roles)) for name, roles in snapshot['role_counts'])
+        save_json(ROLE_HISTORY_FILE, ROLE_COUNTS)
+        invalidate_pregenerated()
+    
+    by_name = {s['name']: s for s in STUDENTS_DATA['students']}
+    current_groups = [
+        [by_name.get(name, {"name": name, "gender": ""}) for name in group]
+        for group in snapshot['groups']
+    ]
+    current_seating = list(snapshot['seating'])
+    current_sections = list(snapshot['sections'])
+    current_remaining = list(snapshot['remaining'])
+    current_remaining_sections = list(snapshot['remaining_sections'])
+    current_roles = dict(snapshot['roles'])
+    current_timestamp = snapshot['timestamp']
+    index_groups()
+    
+    mark_state_changed()
+    notify_group_listeners()
+
+# Incremental repair after attendance changes. GROUP_INDEX maps each grouped
+# student to their group, LEFTOVERS holds the ungrouped present students and
+# LEFTOVER_SECTIONS their sections, OPEN_GROUPS the groups short of group_size
+# and FULL_GROUPS the rest, by section (None for a flat grouping). PARTNERS
+# maps each student to the names they must not share a group with. They are
+# rebuilt only when the whole grouping is replaced, so a repair touches just
+# the groups involved. Each section is its own room, so a repair never moves
+# anyone between sections, and SECTION_HEADCOUNT keeps newcomers out of full
+# rooms.
+GROUP_INDEX = {}
+LEFTOVERS = {}
+LEFTOVER_SECTIONS = {}
+SECTION_HEADCOUNT = {}  # {section: students in the room}, empty for a flat grouping
+OPEN_GROUPS = set()
+FULL_GROUPS = {}
+PARTNERS = {}
+REPAIR_DONORS = 4  # full groups considered when borrowing a member
+
+def section_of(i):
+    return current_sections[i] if i < len(current_sections) else None
+
+def index_groups():
+    """Rebuild the repair indexes for the current grouping"""
+    GROUP_INDEX.clear()
+    LEFTOVERS.clear()
+    LEFTOVER_SECTIONS.clear()
+    SECTION_HEADCOUNT.clear()
+    OPEN_GROUPS.clear()
+    FULL_GROUPS.clear()
+    PARTNERS.clear()
+    for i, group in enumerate(current_groups):
+        for member in group:
+            GROUP_INDEX[member['name']] = i
+        update_open(i)
+    for pair in STUDENTS_DATA.get('restrictions', []):
+        if len(pair) == 2:
+            PARTNERS.setdefault(pair[0], set()).add(pair[1])
+            PARTNERS.setdefault(pair[1], set()).add(pair[0])
+    leftover_names = set(current_remaining)
+    for student in STUDENTS_DATA['students']:
+        if student['name'] in leftover_names:
+            LEFTOVERS[student['name']] = student
+    LEFTOVER_SECTIONS.update(zip(current_remaining, current_remaining_sections))
+    if current_sections:
+        for i, group in enumerate(current_groups):
+            SECTION_HEADCOUNT[current_sections[i]] = SECTION_HEADCOUNT.get(current_sections[i], 0) + len(group)
+        for section in current_remaining_sections:
+            SECTION_HEADCOUNT[section] = SECTION_HEADCOUNT.get(section, 0) + 1
+
+def update_open(i):
+    full = FULL_GROUPS.setdefault(section_of(i), set())
+    if len(current_groups[i]) < SETTINGS['group_size']:
+        OPEN_GROUPS.add(i)
+        full.discard(i)
+    else:
+        OPEN_GROUPS.discard(i)
+        full.add(i)
+
+def shift_group_indexes(pos, step):
+    """After an insert (+1) or delete (-1), renumber the groups that were at pos or later"""
+    for j in range(pos + step, len(current_groups)):
+        for member in current_groups[j]:
+            GROUP_INDEX[member['name']] = j
+    for groups in [OPEN_GROUPS] + list(FULL_GROUPS.values()):
+        shifted = {j + step if j >= pos else j for j in groups}
+        groups.clear()
+        groups.update(shifted)
+
+def delete_group(i):
+    """Drop group i, shifting the indexes of the groups after it down by one"""
+    OPEN_GROUPS.discard(i)
+    FULL_GROUPS.get(section_of(i), set()).discard(i)
+    del current_groups[i]
+    if i < len(current_seating):
+        del current_seating[i]
+    if i < len(current_sections):
+        del current_sections[i]
+    shift_group_indexes(i + 1, -1)
+
+def insert_group(pos, group, seat, section):
+    """Add a group at pos, shifting the indexes of the groups after it up by one"""
+    current_groups.insert(pos, group)
+    current_seating.insert(pos, seat)
+    if section is not None:
+        current_sections.insert(pos, section)
+    shift_group_indexes(pos, 1)
+    for member in group:
+        GROUP_INDEX[member['name']] = pos
+    update_open(pos)
+
+def add_leftover(student, section):
+    LEFTOVERS[student['name']] = student
+    current_remaining.append(student['name'])
+    if section is not None:
+        LEFTOVER_SECTIONS[student['name']] = section
+        current_remaining_sections.append(section)
+
+def drop_leftover(name):
+    del LEFTOVERS[name]
+    pos = current_remaining.index(name)
+    del current_remaining[pos]
+    if pos < len(current_remaining_sections):
+        del current_remaining_sections[pos]
+    LEFTOVER_SECTIONS.pop(name, None)
+
+def fit_penalty(student, group):
+    """Cost of putting a student into a group: restriction clashes, then gender crowding"""
+    partners = PARTNERS.get(student['name'], ())
+    penalty = sum(RESTRICTION_PENALTY for m in group if m['name'] in partners)
+    if SETTINGS['balance_gender'] and student.get('gender'):
+        code = gender_code(student['gender'])
+        penalty += sum(1 for m in group if gender_code(m.get('gender', '')) == code)
+    return penalty
+
+def give_free_role(student, group, vacated=None):
+    """Hand a joining student the vacated role, or one the group is missing"""
+    if not (SETTINGS['assign_roles'] and current_roles):
+        return
+    role = vacated
+    if role is None:
+        held = [current_roles.get(m['name']) for m in group if m is not student]
+        free = role_slots(len(group))
+        for role_held in held:
+            if role_held in free:
+                free.remove(role_held)
+        role = free[0] if free else ""
+    current_roles[student['name']] = role
+    if role:
+        counts = ROLE_COUNTS.setdefault(student['name'], {})
+        counts[role] = counts.get(role, 0) + 1
+
+def move_into(student, i, vacated=None):
+    current_groups[i].append(student)
+    GROUP_INDEX[student['name']] = i
+    give_free_role(student, current_groups[i], vacated)
+    update_open(i)
+
+def take_out(name, i):
+    """Remove a student from group i, returns (their record, their role)"""
+    group = current_groups[i]
+    pos = next(p for p, m in enumerate(group) if m['name'] == name)
+    student = group.pop(pos)
+    del GROUP_INDEX[name]
+    update_open(i)
+    return student, current_roles.pop(name, None)
+
+def repair_absent(student):
+    """Take a newly absent student out of the groups with as few moves as possible"""
+    name = student['name']
+    if name in LEFTOVERS:
+        if name in LEFTOVER_SECTIONS:
+            SECTION_HEADCOUNT[LEFTOVER_SECTIONS[name]] -= 1
+        drop_leftover(name)
+        return []
+    if name not in GROUP_INDEX:
+        return []
+    
+    i = GROUP_INDEX[name]
+    group = current_groups[i]
+    section = section_of(i)
+    if section is not None:
+        SECTION_HEADCOUNT[section] -= 1
+    _, vacated = take_out(name, i)
+    moves = []
+    
+    leftovers = [s for s in LEFTOVERS.values() if LEFTOVER_SECTIONS.get(s['name']) == section]
+    if leftovers:
+        # Fill the seat from the leftovers in the same room
+        best = min(leftovers, key=lambda s: fit_penalty(s, group))
+        drop_leftover(best['name'])
+        move_into(best, i, vacated)
+        moves.append(f"{best['name']} joined Group {i + 1}")
+    elif len(group) < SETTINGS['group_size'] - 1:
+        # Two short of the others now: borrow one member from a full group in
+        # the same room, looking at a handful of them rather than the whole class
+        donors = list(islice(FULL_GROUPS.get(section, ()), REPAIR_DONORS))
+        if donors:
+            j, mover = min(
+                ((j, m) for j in donors for m in current_groups[j]),
+                key=lambda pair: fit_penalty(pair[1], group)
+            )
+            take_out(mover['name'], j)
+            move_into(mover, i, vacated)
+            moves.append(f"{mover['name']} moved from Group {j + 1} to Group {i + 1}")
+    
+    if len(group) <= 1 and len(current_groups) > 1:
+        # A group of one is no group: fold the last member in elsewhere
+        lone = group[0] if group else None
+        if lone:
+            take_out(lone['name'], i)
+        delete_group(i)
+        if lone:
+            moves.extend(repair_present(lone, section))
+    return moves
+
+def choose_section():
+    """Room for a student who was absent when the cohort was split: one with a
+    free seat, preferring an open group, then the most students waiting for a
+    new group, then the emptiest. The emptiest room when all are full."""
+    capacity = SETTINGS.get('section_capacity', 0)
+    with_room = [room for room, count in SECTION_HEADCOUNT.items() if not capacity or count < capacity]
+    if not with_room:
+        return min(SECTION_HEADCOUNT, key=SECTION_HEADCOUNT.get)
+    open_rooms = {section_of(j) for j in OPEN_GROUPS}
+    waiting = {}
+    for room in LEFTOVER_SECTIONS.values():
+        waiting[room] = waiting.get(room, 0) + 1
+    return max(with_room, key=lambda room: (room in open_rooms, waiting.get(room, 0), -SECTION_HEADCOUNT[room]))
+
+def repair_present(student, section=None):
+    """Place a newly present student into the groups with as few moves as possible.
+    With a section, only that room's groups and leftovers are considered."""
+    if section is None and SECTION_HEADCOUNT:
+        section = choose_section()
+        SECTION_HEADCOUNT[section] += 1
+    open_groups = [j for j in OPEN_GROUPS if section is None or section_of(j) == section]
+    if open_groups:
+        i = min(open_groups, key=lambda j: (len(current_groups[j]), fit_penalty(student, current_groups[j])))
+        move_into(student, i)
+        return [f"{student['name']} joined Group {i + 1}"]
+    
+    add_leftover(student, section)
+    group = [s for s in LEFTOVERS.values() if LEFTOVER_SECTIONS.get(s['name']) == section]
+    if len(group) < SETTINGS['group_size']:
+        return []
+    
+    # Enough leftovers in this room for a whole new group, placed after its
+    # section's other groups
+    for member in group:
+        drop_leftover(member['name'])
+    if section is None:
+        first = i = len(current_groups)
+    else:
+        first = bisect_left(current_sections, section)
+        i = bisect_right(current_sections, section)
+    taken = set(current_seating[first:i])
+    free_seats = [seat for seat in SEATING_AREAS if seat not in taken]
+    insert_group(i, group, random.choice(free_seats) if free_seats else "", section)
+    if SETTINGS['assign_roles'] and current_roles:
+        current_roles.update(assign_roles([group], ROLE_COUNTS))
+    return [f"New Group {i + 1} formed from the remaining students"]
+
+# Background pre-generation: a worker thread keeps a few candidate groupings
+# ready for the current roster and settings so /generate only has to commit
+# one. Candidates carry no roles; those depend on ROLE_COUNTS at commit time.
+PREGEN_POOL_SIZE = 3
+pregen_cond = threading.Condition()
+pregen_version = 0
+pregen_candidates = []  # [(penalty, groups, remaining names, seating, sections)]
+pregen_thread = None
+
+def invalidate_pregenerated():
+    """Drop candidates built from an older roster or settings"""
+    global pregen_version
+    with pregen_cond:
+        pregen_version += 1
+        pregen_candidates.clear()
+        pregen_cond.notify_all()
+
+def pregen_worker():
+    while True:
+        with pregen_cond:
+            while len(pregen_candidates) >= PREGEN_POOL_SIZE:
+                pregen_cond.wait()
+            version = pregen_version
+            present_students = [s for s in STUDENTS_DATA['students'] if not s['absent']]
+            settings = dict(SETTINGS, assign_roles=False)
+            restrictions = list(STUDENTS_DATA.get('restrictions', []))
+            if not present_students:
+                # Nothing to group until the roster changes
+                while version == pregen_version:
+                    pregen_cond.wait()
+                continue
+        
+        groups, remaining, _, seating, sections, remaining_sections = build_cohort(
+            present_students, settings, {}, restrictions
+        )
+        penalty = grouping_penalty(groups, present_students, settings, restrictions)
+        with pregen_cond:
+            if version == pregen_version:
+                pregen_candidates.append((penalty, groups, remaining, seating, sections, remaining_sections))
+
+def ensure_pregen_worker():
+    """Start the pre-generation thread on first use"""
+    global pregen_thread
+    if pregen_thread is None:
+        pregen_thread = threading.Thread(target=pregen_worker, name='pregen', daemon=True)
+        pregen_thread.start()
+
+def take_pregenerated():
+    """Best ready candidate as (groups, remaining, seating, sections, remaining sections), or None"""
+    with pregen_cond:
+        if not pregen_candidates:
+            return None
+        best = min(range(len(pregen_candidates)), key=lambda i: pregen_candidates[i][0])
+        _, groups, remaining, seating, sections, remaining_sections = pregen_candidates.pop(best)
+        pregen_cond.notify_all()
+    return groups, remaining, seating, sections, remaining_sections
+
+# One page of the Students tab, also served on its own by /students
+STUDENT_LIST_TEMPLATE = '''
+{% for student in students %}
+    <div class="student-card {% if student.absent %}absent{% endif %}">
+        <span class="name">{{ student.name }}</span>
+        {% if student.gender %}
+            <span class="gender">{{ student.gender }}</span>
+        {% endif %}
+        {% if student.notes %}
+            <span class="notes-icon" title="{{ student.notes }}">📝</span>
+        {% endif %}
+        <form method="POST" action="{{ url_for('toggle_absence') }}" style="display: inline;">
+            <input type="hidden" name="student_name" value="{{ student.name }}">
+            <button type="submit" class="absence-btn">
+                {% if student.absent %}✓ Present{% else %}✗ Absent{% endif %}
+            </button>
+        </form>
+        <button class="edit-btn" onclick="editStudent('{{ student.name }}')">✏️</button>
+        <form method="POST" action="{{ url_for('remove_student') }}" style="display: inline;">
+            <input type="hidden" name="student_name" value="{{ student.name }}">
+            <button type="submit" class="remove-btn" onclick="return confirm('Remove {{ student.name }}?')">✕</button>
+        </form>
+    </div>
+{% endfor %}
+{% if not students %}
+    <p style="color: var(--text-secondary);">No students match.</p>
+{% endif %}
+{% if total > per_page %}
+    <div class="pager no-print">
+        {% if page > 1 %}
+            <button type="button" class="absence-btn" onclick="loadStudents({{ page - 1 }})">← Prev</button>
+        {% endif %}
+        <span>{{ first }}–{{ last }} of {{ total }}</span>
+        {% if last < total %}
+            <button type="button" class="absence-btn" onclick="loadStudents({{ page + 1 }})">Next →</button>
+        {% endif %}
+    </div>
+{% endif %}
+'''
+
 HTML_TEMPLATE = '''
 <!DOCTYPE html>
 <html data-theme="{{ 'dark' if settings.dark_mode else 'light' }}">
@@ -285,6 +1635,21 @@ HTML_TEMPLATE = '''
             margin: 20px 0;
         }
         
+        .student-search {
+            display: flex;
+            gap: 8px;
+            flex-wrap: wrap;
+            margin-bottom: 10px;
+        }
+        
+        .pager {
+            display: flex;
+            gap: 10px;
+            align-items: center;
+            margin-top: 10px;
+            color: var(--text-secondary);
+        }
+        
         .student-card {
             display: inline-flex;
             align-items: center;
@@ -551,7 +1916,7 @@ HTML_TEMPLATE = '''
         </div>
         
         {% if message %}
-            <div class="message {{ 'success' if 'added' in message or 'removed' in message or 'saved' in message else 'warning' }}">
+            <div class="message {{ 'success' if 'added' in message or 'removed' in message or 'saved' in message or 'Undid' in message or 'Redid' in message or 'adjusted' in message else 'warning' }}">
                 {{ message }}
             </div>
         {% endif %}
@@ -568,10 +1933,20 @@ HTML_TEMPLATE = '''
                 <button class="btn btn-secondary" onclick="exportCSV()">
                     📥 Export CSV
                 </button>
+                <button class="btn btn-secondary" onclick="document.getElementById('undoForm').submit()" {% if not can_undo %}disabled{% endif %}>
+                    ↩️ Undo
+                </button>
+                <button class="btn btn-secondary" onclick="document.getElementById('redoForm').submit()" {% if not can_redo %}disabled{% endif %}>
+                    ↪️ Redo
+                </button>
             </div>
             
+            <form id="undoForm" method="POST" action="{{ url_for('undo') }}" style="display:none;"></form>
+            <form id="redoForm" method="POST" action="{{ url_for('redo') }}" style="display:none;"></form>
+            
             <form id="generateForm" method="POST" action="{{ url_for('generate') }}" style="display:none;"></form>
             
+            <div id="groupsContainer">
             {% if current_timestamp %}
                 <p style="text-align: center; color: var(--text-secondary);">
                     Generated on: {{ current_timestamp }}
@@ -585,6 +1960,9 @@ HTML_TEMPLATE = '''
                 </div>
                 
                 {% for i in range(groups|length) %}
+                    {% if sections and (i == 0 or sections[i] != sections[i - 1]) %}
+                        <h2>🏫 Section {{ sections[i] + 1 }}</h2>
+                    {% endif %}
                     <div class="group">
                         <div class="group-header">
                             <h3>Group {{ i + 1 }}</h3>
@@ -593,8 +1971,8 @@ HTML_TEMPLATE = '''
                         <div class="group-members">
                             {% for member in groups[i] %}
                                 <div class="member-card">
-                                    {% if settings.assign_roles and member.role %}
-                                        <div class="member-role">{{ member.role }}</div>
+                                    {% if settings.assign_roles and roles.get(member.name) %}
+                                        <div class="member-role">{{ roles[member.name] }}</div>
                                     {% endif %}
                                     <div class="name">{{ member.name }}</div>
                                     {% if member.gender %}
@@ -619,6 +1997,7 @@ HTML_TEMPLATE = '''
                     Click "Generate Random Groups" to create groups
                 </p>
             {% endif %}
+            </div>
         </div>
         
         <!-- STUDENTS TAB -->
@@ -639,34 +2018,46 @@ HTML_TEMPLATE = '''
             
             <div class="student-list">
                 <h3>All Students ({{ students|length }}) - {{ present_count }} Present</h3>
-                {% for student in students %}
-                    <div class="student-card {% if student.absent %}absent{% endif %}">
-                        <span class="name">{{ student.name }}</span>
-                        {% if student.gender %}
-                            <span class="gender">{{ student.gender }}</span>
-                        {% endif %}
-                        {% if student.notes %}
-                            <span class="notes-icon" title="{{ student.notes }}">📝</span>
-                        {% endif %}
-                        <form method="POST" action="{{ url_for('toggle_absence') }}" style="display: inline;">
-                            <input type="hidden" name="student_name" value="{{ student.name }}">
-                            <button type="submit" class="absence-btn">
-                                {% if student.absent %}✓ Present{% else %}✗ Absent{% endif %}
-                            </button>
-                        </form>
-                        <button class="edit-btn" onclick="editStudent('{{ student.name }}')">✏️</button>
-                        <form method="POST" action="{{ url_for('remove_student') }}" style="display: inline;">
-                            <input type="hidden" name="student_name" value="{{ student.name }}">
-                            <button type="submit" class="remove-btn" onclick="return confirm('Remove {{ student.name }}?')">✕</button>
-                        </form>
-                    </div>
-                {% endfor %}
+                <form method="POST" action="{{ url_for('mark_all_present') }}" class="no-print" style="margin-bottom: 10px;">
+                    <button type="submit" class="absence-btn">✓ Mark All Present</button>
+                </form>
+                <div class="student-search no-print">
+                    <input type="text" id="studentQuery" placeholder="Search by name" oninput="searchStudents()">
+                    <select id="studentMatch" onchange="loadStudents(1)">
+                        <option value="prefix">Starts with</option>
+                        <option value="contains">Contains</option>
+                    </select>
+                    <select id="studentGender" onchange="loadStudents(1)">
+                        <option value="">Any gender</option>
+                        <option value="M">Male</option>
+                        <option value="F">Female</option>
+                    </select>
+                    <select id="studentAbsent" onchange="loadStudents(1)">
+                        <option value="">Present and absent</option>
+                        <option value="0">Present only</option>
+                        <option value="1">Absent only</option>
+                    </select>
+                    <select id="studentNotes" onchange="loadStudents(1)">
+                        <option value="">With or without notes</option>
+                        <option value="1">With notes</option>
+                        <option value="0">Without notes</option>
+                    </select>
+                </div>
+                <div id="studentList">{{ student_list|safe }}</div>
             </div>
         </div>
         
         <!-- HISTORY TAB -->
         <div id="history-tab" class="tab-content">
             <h3>Group History</h3>
+            {% if archived_count %}
+                <p style="color: var(--text-secondary);">{{ archived_count }} older records are archived.</p>
+            {% endif %}
+            {% if history or archived_count %}
+                <button class="btn btn-secondary no-print" onclick="window.location.href='{{ url_for('export_history') }}'">
+                    📥 Export Full History
+                </button>
+            {% endif %}
             {% if history %}
                 {% for record in history[-10:][::-1] %}
                     <div class="history-item">
@@ -730,6 +2121,42 @@ HTML_TEMPLATE = '''
                             <strong>Assign Group Roles</strong>
                         </label>
                     </div>
+                    <div class="setting-item">
+                        <label>
+                            <input type="checkbox" name="picker_weighted" {% if settings.get('picker_weighted', True) %}checked{% endif %}>
+                            <strong>Picker Favors Less-Picked Students</strong>
+                        </label>
+                    </div>
+                    <div class="setting-item">
+                        <label>
+                            <input type="checkbox" name="picker_no_repeat" {% if settings.picker_no_repeat %}checked{% endif %}>
+                            <strong>Picker: No Repeats Until Everyone Is Picked</strong>
+                        </label>
+                    </div>
+                    <div class="setting-item">
+                        <label>
+                            <strong>Keep Last Records:</strong>
+                            <input type="number" name="history_keep_records" value="{{ settings.get('history_keep_records', 100) }}" min="0">
+                        </label>
+                    </div>
+                    <div class="setting-item">
+                        <label>
+                            <strong>Keep Last Days:</strong>
+                            <input type="number" name="history_keep_days" value="{{ settings.get('history_keep_days', 0) }}" min="0">
+                        </label>
+                    </div>
+                    <div class="setting-item">
+                        <label>
+                            <strong>Section Capacity (0 = one section):</strong>
+                            <input type="number" name="section_capacity" value="{{ settings.get('section_capacity', 0) }}" min="0">
+                        </label>
+                    </div>
+                    <div class="setting-item">
+                        <label>
+                            <strong>Profile Sample Rate:</strong>
+                            <input type="number" name="profile_sample_rate" value="{{ settings.get('profile_sample_rate', 0) }}" min="0" max="1" step="0.01">
+                        </label>
+                    </div>
                 </div>
                 <button type="submit" class="btn btn-primary">💾 Save Settings</button>
             </form>
@@ -748,13 +2175,22 @@ HTML_TEMPLATE = '''
             event.target.classList.add('active');
         }
         
+        // Clicks until shortly after the answer arrives share one key, so a
+        // double click is a single pick
+        let pickKey = null;
+        
         function pickRandomStudent() {
-            const students = {{ students|map(attribute='name')|list|tojson }};
-            const presentStudents = students.filter((s, i) => !{{ students|map(attribute='absent')|list|tojson }}[i]);
-            if (presentStudents.length > 0) {
-                const picked = presentStudents[Math.floor(Math.random() * presentStudents.length)];
-                document.getElementById('pickedStudent').textContent = picked;
-            }
+            if (!pickKey) pickKey = newIdempotencyKey();
+            const key = pickKey;
+            fetch('{{ url_for("pick_student") }}', {method: 'POST', headers: {'Idempotency-Key': key}})
+                .then(response => response.json())
+                .then(data => {
+                    document.getElementById('pickedStudent').textContent =
+                        data.status === 'success' ? data.name : data.message;
+                })
+                .finally(() => setTimeout(() => {
+                    if (pickKey === key) pickKey = null;
+                }, 1000));
         }
         
         function setTimer(minutes) {
@@ -795,12 +2231,60 @@ HTML_TEMPLATE = '''
             updateTimerDisplay();
         }
         
+        function newIdempotencyKey() {
+            return window.crypto && crypto.randomUUID
+                ? crypto.randomUUID()
+                : Date.now() + '-' + Math.random().toString(36).slice(2);
+        }
+        
+        // One key per form per page load, so double submits are recognised server-side
+        function addIdempotencyKeys(root) {
+            root.querySelectorAll('form[method="POST"]').forEach(form => {
+                const input = document.createElement('input');
+                input.type = 'hidden';
+                input.name = 'idempotency_key';
+                input.value = newIdempotencyKey();
+                form.append(input);
+            });
+        }
+        addIdempotencyKeys(document);
+        
+        let studentRequest = 0;
+        let searchTimer;
+        
+        function searchStudents() {
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(() => loadStudents(1), 200);
+        }
+        
+        function loadStudents(page) {
+            const requestId = ++studentRequest;
+            const params = new URLSearchParams({
+                format: 'html',
+                page: page,
+                q: document.getElementById('studentQuery').value,
+                match: document.getElementById('studentMatch').value,
+                gender: document.getElementById('studentGender').value,
+                absent: document.getElementById('studentAbsent').value,
+                notes: document.getElementById('studentNotes').value
+            });
+            fetch('{{ url_for("students") }}?' + params)
+                .then(response => response.text())
+                .then(html => {
+                    // Ignore answers to searches the user has already typed past
+                    if (requestId !== studentRequest) return;
+                    const list = document.getElementById('studentList');
+                    list.innerHTML = html;
+                    addIdempotencyKeys(list);
+                });
+        }
+        
         function editStudent(name) {
             const notes = prompt('Edit notes for ' + name + ':');
             if (notes !== null) {
                 fetch('{{ url_for("edit_student") }}', {
                     method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
+                    headers: {'Content-Type': 'application/json', 'Idempotency-Key': newIdempotencyKey()},
                     body: JSON.stringify({name: name, notes: notes})
                 }).then(() => location.reload());
             }
@@ -809,31 +2293,324 @@ HTML_TEMPLATE = '''
         function exportCSV() {
             window.location.href = '{{ url_for("export_csv") }}';
         }
+        
+        function makeElement(tag, className, text) {
+            const element = document.createElement(tag);
+            if (className) element.className = className;
+            if (text !== undefined) element.textContent = text;
+            return element;
+        }
+        
+        function renderGroups(data) {
+            const container = document.getElementById('groupsContainer');
+            container.replaceChildren();
+            
+            if (data.timestamp) {
+                const stamp = makeElement('p', null, 'Generated on: ' + data.timestamp);
+                stamp.style.cssText = 'text-align: center; color: var(--text-secondary);';
+                container.append(stamp);
+            }
+            
+            const summary = makeElement('div', null, data.groups.length + ' groups of ' + data.group_size);
+            summary.style.cssText = 'text-align: center; margin: 15px 0; color: var(--text-secondary);';
+            container.append(summary);
+            
+            data.groups.forEach((group, i) => {
+                if (group.section !== null && (i === 0 || group.section !== data.groups[i - 1].section)) {
+                    container.append(makeElement('h2', null, '🏫 Section ' + (group.section + 1)));
+                }
+                const box = makeElement('div', 'group');
+                const header = makeElement('div', 'group-header');
+                header.append(makeElement('h3', null, 'Group ' + (i + 1)), makeElement('span', 'seating', '📍 ' + group.seating));
+                const members = makeElement('div', 'group-members');
+                group.members.forEach(member => {
+                    const card = makeElement('div', 'member-card');
+                    if (member.role) card.append(makeElement('div', 'member-role', member.role));
+                    card.append(makeElement('div', 'name', member.name));
+                    if (member.gender) card.append(makeElement('span', 'gender', member.gender));
+                    members.append(card);
+                });
+                box.append(header, members);
+                container.append(box);
+            });
+            
+            if (data.remaining.length) {
+                const box = makeElement('div');
+                box.style.cssText = 'margin: 15px 0; padding: 15px; background: #fff3e0; border-radius: 5px; border-left: 4px solid var(--accent-orange);';
+                box.append(makeElement('h3', null, 'Remaining Students (' + data.remaining.length + ')'));
+                data.remaining.forEach(name => box.append(makeElement('span', 'student-card', name)));
+                container.append(box);
+            }
+        }
+        
+        {% if live_updates %}
+        // Pushed by the ASGI server (asgi.py) whenever groups change
+        new EventSource('{{ request.script_root }}/events').onmessage = event => {
+            renderGroups(JSON.parse(event.data));
+        };
+        {% endif %}
     </script>
 </body>
 </html>
 '''
 
+# Idempotent POSTs: a repeated idempotency key (form field or header) within
+# IDEMPOTENCY_TTL gets the first response replayed, and a duplicate that
+# arrives while the first is still running waits for it instead of redoing it.
+IDEMPOTENCY_TTL = 60
+idempotency_lock = threading.Lock()
+idempotency_results = OrderedDict()  # {(endpoint, key): entry}, oldest first
+
+def idempotent(view):
+    """Serve duplicate submissions of a mutating route from a short-lived cache"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+        if not key:
+            return view(*args, **kwargs)
+        
+        key = (request.endpoint, key)
+        now = time.time()
+        with idempotency_lock:
+            while idempotency_results and next(iter(idempotency_results.values()))['expires'] < now:
+                idempotency_results.popitem(last=False)
+            entry = idempotency_results.get(key)
+            first = entry is None
+            if first:
+                entry = {"expires": now + IDEMPOTENCY_TTL, "done": threading.Event(), "response": None}
+                idempotency_results[key] = entry
+        
+        if not first:
+            entry['done'].wait(IDEMPOTENCY_TTL)
+            if entry['response'] is not None:
+                body, status, headers = entry['response']
+                return Response(body, status=status, headers=headers)
+            # The first attempt failed, so this one does the work
+            return view(*args, **kwargs)
+        
+        try:
+            response = app.make_response(view(*args, **kwargs))
+            entry['response'] = (response.get_data(), response.status_code, list(response.headers))
+            return response
+        except Exception:
+            with idempotency_lock:
+                idempotency_results.pop(key, None)
+            raise
+        finally:
+            entry['done'].set()
+    return wrapper
+
+# Opt-in sampling profiler. A fraction of requests (profile_sample_rate in
+# SETTINGS, or the GROUP_PROFILE_RATE env var) is watched by a sampler thread
+# that grabs the request thread's stack every PROFILE_INTERVAL seconds. Stacks
+# are aggregated in folded format ("frame;frame;frame count") and flushed to
+# PROFILE_DIR, ready for flamegraph.pl or speedscope. Unsampled requests pay
+# one random() call.
+PROFILE_INTERVAL = 0.005
+PROFILE_FLUSH_SECONDS = 10
+profile_lock = threading.Lock()
+profile_active = threading.Event()
+profiled_threads = {}  # {thread id: endpoint}
+profile_stacks = {}  # {folded stack: samples} for profile_day only
+profile_day = None
+profiler_thread = None
+
+def read_env_profile_rate():
+    """GROUP_PROFILE_RATE as a float, None when unset, 0 when malformed"""
+    rate = os.environ.get('GROUP_PROFILE_RATE')
+    if not rate:
+        return None
+    try:
+        return min(1.0, max(0.0, float(rate)))
+    except ValueError:
+        print(f"⚠️ Ignoring invalid GROUP_PROFILE_RATE={rate!r}", file=sys.stderr)
+        return 0.0
+
+ENV_PROFILE_RATE = read_env_profile_rate()
+
+def profile_rate():
+    if ENV_PROFILE_RATE is not None:
+        return ENV_PROFILE_RATE
+    return SETTINGS.get('profile_sample_rate', 0)
+
+def fold_stack(label, frame):
+    """One folded stack line, root first"""
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    frames.append(label)
+    return ';'.join(reversed(frames))
+
+def flush_profile(day, stacks):
+    """Write the aggregated stacks of one day, replacing that day's previous flush"""
+    lines = [f"{stack} {count}\n" for stack, count in stacks.items()]
+    if not lines:
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"stacks-{day}.folded")
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+    os.replace(path + '.tmp', path)
+
+def take_profile_stacks(reset):
+    """Copy of (profile_day, profile_stacks), starting a new day's aggregate if reset"""
+    global profile_stacks, profile_day
+    with profile_lock:
+        day, stacks = profile_day, profile_stacks
+        if reset:
+            profile_stacks = {}
+            profile_day = datetime.now().strftime('%Y%m%d')
+        else:
+            stacks = dict(stacks)
+    return day, stacks
+
+def sampler_loop():
+    last_flush = time.time()
+    dirty = False
+    take_profile_stacks(reset=True)
+    while True:
+        active = profile_active.wait(PROFILE_FLUSH_SECONDS)
+        # Flush when idle or every PROFILE_FLUSH_SECONDS, and start a fresh
+        # aggregate when the date changes so each file holds one day
+        new_day = profile_day != datetime.now().strftime('%Y%m%d')
+        if new_day or (dirty and (not active or time.time() - last_flush >= PROFILE_FLUSH_SECONDS)):
+            flush_profile(*take_profile_stacks(reset=new_day))
+            last_flush = time.time()
+            dirty = False
+        if not active:
+            # Idle: sleep until the next sampled request
+            continue
+        time.sleep(PROFILE_INTERVAL)
+        frames = sys._current_frames()
+        with profile_lock:
+            for thread_id, label in profiled_threads.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stack = fold_stack(label, frame)
+                    profile_stacks[stack] = profile_stacks.get(stack, 0) + 1
+                    dirty = True
+
+def profiled(view):
+    """Sample the stack of a fraction of calls to a route"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        rate = profile_rate()
+        if not rate or random.random() >= rate:
+            return view(*args, **kwargs)
+        
+        global profiler_thread
+        thread_id = threading.get_ident()
+        with profile_lock:
+            if profiler_thread is None:
+                profiler_thread = threading.Thread(target=sampler_loop, name='profiler', daemon=True)
+                profiler_thread.start()
+            profiled_threads[thread_id] = request.endpoint or view.__name__
+            profile_active.set()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            with profile_lock:
+                profiled_threads.pop(thread_id, None)
+                if not profiled_threads:
+                    profile_active.clear()
+    return wrapper
+
+state_loaded = False
+state_load_lock = threading.Lock()
+
+def init_app_state():
+    """Load the web app's data files (creating defaults) from the working directory"""
+    global STUDENTS_DATA, HISTORY, SETTINGS, ROLE_COUNTS, PICK_COUNTS, ATTENDANCE, ARCHIVE_INDEX, VERSION_INDEX
+    STUDENTS_DATA = load_students()
+    HISTORY = load_json(HISTORY_FILE, [])
+    SETTINGS = load_settings()
+    ROLE_COUNTS = load_json(ROLE_HISTORY_FILE, {})
+    PICK_COUNTS = load_json(PICK_HISTORY_FILE, {})
+    ATTENDANCE = load_attendance()
+    apply_attendance()
+    ARCHIVE_INDEX = load_archive_index()
+    recover_archive()
+    archive_history()
+    
+    invalidate_picker()
+    invalidate_roster_index()
+    invalidate_pregenerated()
+    del VERSIONS[:]
+    VERSION_INDEX = -1
+    record_version("Start")
+    mark_state_changed()
+
+@app.before_request
+def ensure_state_loaded():
+    global state_loaded
+    if not state_loaded:
+        with state_load_lock:
+            if not state_loaded:
+                init_app_state()
+                state_loaded = True
+    # The first request of each day logs the day, even if nobody is absent
+    ensure_attendance_day()
+
 @app.route('/')
+@profiled
 def index():
+    ensure_pregen_worker()
     message = request.args.get('message', '')
+    key = (STATE_VERSION, message)
+    page = PAGE_CACHE.get(key)
+    if page is None:
+        body = render_index(message).encode('utf-8')
+        page = {"etag": hashlib.sha1(body).hexdigest(), "bodies": {"identity": body}}
+        if len(PAGE_CACHE) >= PAGE_CACHE_MAX:
+            PAGE_CACHE.clear()
+        PAGE_CACHE[key] = page
+    
+    encoding = negotiate_encoding()
+    etag = page['etag'] if encoding == 'identity' else f"{page['etag']}-{encoding}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        if encoding not in page['bodies']:
+            page['bodies'][encoding] = compress_body(page['bodies']['identity'], encoding)
+        response = Response(page['bodies'][encoding], mimetype='text/html')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def render_index(message):
+    """Render the full page for the current state"""
     present_count = sum(1 for s in STUDENTS_DATA['students'] if not s['absent'])
     
     return render_template_string(
         HTML_TEMPLATE,
         students=STUDENTS_DATA['students'],
+        student_list=render_student_list(search_students(), 1),
         present_count=present_count,
         groups=current_groups,
         seating=current_seating,
+        sections=current_sections,
         remaining=current_remaining,
+        roles=current_roles,
         num_groups=len(current_groups),
         current_timestamp=current_timestamp,
         settings=SETTINGS,
+        live_updates=LIVE_UPDATES,
+        can_undo=VERSION_INDEX > 0,
+        can_redo=VERSION_INDEX < len(VERSIONS) - 1,
         history=HISTORY,
+        archived_count=sum(segment['count'] for segment in ARCHIVE_INDEX),
         message=message
     )
 
 @app.route('/add_student', methods=['POST'])
+@idempotent
+@profiled
 def add_student():
     name = request.form.get('student_name', '').strip()
     gender = request.form.get('gender', '').strip()
@@ -846,7 +2623,14 @@ def add_student():
             "absent": False,
             "gender": gender
         })
-        save_json(STUDENTS_FILE, STUDENTS_DATA)
+        save_students()
+        set_present(name, True)
+        save_attendance()
+        invalidate_roster_index()
+        invalidate_picker()
+        invalidate_pregenerated()
+        record_version(f"Add {name}")
+        mark_state_changed()
         message = f"✅ {name} has been added and saved!"
     elif any(s['name'] == name for s in STUDENTS_DATA['students']):
         message = f"⚠️ {name} is already in the class!"
@@ -856,24 +2640,112 @@ def add_student():
     return redirect(url_for('index', message=message))
 
 @app.route('/remove_student', methods=['POST'])
+@idempotent
+@profiled
 def remove_student():
     name = request.form.get('student_name', '').strip()
     STUDENTS_DATA['students'] = [s for s in STUDENTS_DATA['students'] if s['name'] != name]
-    save_json(STUDENTS_FILE, STUDENTS_DATA)
+    save_students()
+    if name in ATTENDANCE["ids"]:
+        today_attendance()["roster"] &= ~attendance_bit(name)
+        save_attendance()
+    invalidate_roster_index()
+    invalidate_picker()
+    invalidate_pregenerated()
+    record_version(f"Remove {name}")
+    mark_state_changed()
     message = f"✅ {name} has been removed and saved!"
     return redirect(url_for('index', message=message))
 
 @app.route('/toggle_absence', methods=['POST'])
+@idempotent
+@profiled
 def toggle_absence():
     name = request.form.get('student_name', '').strip()
+    moves = []
     for student in STUDENTS_DATA['students']:
         if student['name'] == name:
             student['absent'] = not student['absent']
-            save_json(STUDENTS_FILE, STUDENTS_DATA)
+            set_present(name, not student['absent'])
+            save_attendance()
+            invalidate_picker()
+            invalidate_pregenerated()
+            
+            # Patch the groups on screen instead of regenerating them
+            if current_groups:
+                moves = repair_absent(student) if student['absent'] else repair_present(student)
+                if SETTINGS['assign_roles']:
+                    save_json(ROLE_HISTORY_FILE, ROLE_COUNTS)
+                notify_group_listeners()
+            
+            record_version(f"Toggle absence of {name}")
+            mark_state_changed()
             break
+    
+    if moves:
+        return redirect(url_for('index', message="✅ Groups adjusted: " + "; ".join(moves)))
     return redirect(url_for('index'))
 
+@app.route('/mark_all_present', methods=['POST'])
+@idempotent
+@profiled
+def mark_all_present():
+    newly_present = [s for s in STUDENTS_DATA['students'] if s['absent']]
+    for student in newly_present:
+        student['absent'] = False
+    day = today_attendance()
+    day["present"] |= day["roster"]
+    save_attendance()
+    
+    if newly_present:
+        invalidate_picker()
+        invalidate_pregenerated()
+        if current_groups:
+            for student in newly_present:
+                repair_present(student)
+            if SETTINGS['assign_roles']:
+                save_json(ROLE_HISTORY_FILE, ROLE_COUNTS)
+            notify_group_listeners()
+        record_version("Mark all present")
+        mark_state_changed()
+    return redirect(url_for('index', message="✅ All students marked present and saved!"))
+
+@app.route('/attendance')
+def attendance():
+    start = request.args.get('start', '0000-00-00')
+    end = request.args.get('end', '9999-99-99')
+    name = request.args.get('name')
+    names = [name] if name else [s['name'] for s in STUDENTS_DATA['students']]
+    return jsonify({"start": start, "end": end, "students": attendance_stats(start, end, names)})
+
+@app.route('/students')
+def students():
+    matches = search_students(
+        request.args.get('q', ''),
+        request.args.get('match', 'prefix'),
+        request.args.get('gender', ''),
+        request.args.get('absent', ''),
+        request.args.get('notes', '')
+    )
+    page = request.args.get('page', 1, type=int)
+    per_page = max(1, min(request.args.get('per_page', STUDENTS_PER_PAGE, type=int), 500))
+    if request.args.get('format') == 'html':
+        return render_student_list(matches, page, per_page)
+    
+    start = (max(1, page) - 1) * per_page
+    return jsonify({
+        "total": len(matches),
+        "page": max(1, page),
+        "per_page": per_page,
+        "students": [
+            {"name": s['name'], "gender": s.get('gender', ''), "absent": s['absent'], "notes": s.get('notes', '')}
+            for s in matches[start:start + per_page]
+        ]
+    })
+
 @app.route('/edit_student', methods=['POST'])
+@idempotent
+@profiled
 def edit_student():
     data = request.get_json()
     name = data.get('name')
@@ -882,14 +2754,19 @@ def edit_student():
     for student in STUDENTS_DATA['students']:
         if student['name'] == name:
             student['notes'] = notes
-            save_json(STUDENTS_FILE, STUDENTS_DATA)
+            save_students()
+            record_version(f"Edit notes of {name}")
+            mark_state_changed()
             break
     
     return jsonify({"status": "success"})
 
 @app.route('/generate', methods=['POST'])
+@idempotent
+@profiled
 def generate():
-    global current_groups, current_seating, current_remaining, current_timestamp
+    global current_groups, current_seating, current_sections, current_remaining, current_remaining_sections
+    global current_roles, current_timestamp
     
     # Get present students only
     present_students = [s for s in STUDENTS_DATA['students'] if not s['absent']]
@@ -897,93 +2774,99 @@ def generate():
     if len(present_students) == 0:
         return redirect(url_for('index', message="⚠️ No students present to create groups!"))
     
-    # Shuffle students
-    shuffled = present_students.copy()
-    random.shuffle(shuffled)
-    
     group_size = SETTINGS['group_size']
-    num_groups = len(shuffled) // group_size
-    current_groups = []
-    
-    # Balance by gender if enabled
-    if SETTINGS['balance_gender'] and any(s['gender'] for s in shuffled):
-        # Separate by gender
-        males = [s for s in shuffled if s.get('gender') == 'M']
-        females = [s for s in shuffled if s.get('gender') == 'F']
-        others = [s for s in shuffled if not s.get('gender')]
-        
-        random.shuffle(males)
-        random.shuffle(females)
-        random.shuffle(others)
-        
-        # Distribute evenly
-        for i in range(num_groups):
-            group = []
-            # Add from each gender pool
-            if males:
-                group.append(males.pop())
-            if females:
-                group.append(females.pop())
-            if males and len(group) < group_size:
-                group.append(males.pop())
-            if females and len(group) < group_size:
-                group.append(females.pop())
-            
-            # Fill remaining spots
-            while len(group) < group_size and (males or females or others):
-                if males:
-                    group.append(males.pop())
-                elif females:
-                    group.append(females.pop())
-                elif others:
-                    group.append(others.pop())
-            
-            current_groups.append(group)
-        
-        current_remaining = [s['name'] for s in males + females + others]
+    ensure_pregen_worker()
+    pregenerated = take_pregenerated()
+    if pregenerated:
+        current_groups, current_remaining, current_seating, current_sections, current_remaining_sections = pregenerated
+        current_roles = assign_roles(current_groups, ROLE_COUNTS) if SETTINGS['assign_roles'] else {}
     else:
-        # Regular grouping
-        for i in range(num_groups):
-            group = shuffled[i*group_size:(i+1)*group_size]
-            current_groups.append(group)
-        
-        current_remaining = [s['name'] for s in shuffled[num_groups*group_size:]]
-    
-    # Assign roles if enabled
+        (current_groups, current_remaining, current_roles, current_seating, current_sections,
+         current_remaining_sections) = build_cohort(
+            present_students, SETTINGS, ROLE_COUNTS, STUDENTS_DATA.get('restrictions', [])
+        )
     if SETTINGS['assign_roles']:
-        for group in current_groups:
-            roles = GROUP_ROLES.copy()
-            random.shuffle(roles)
-            for j, member in enumerate(group):
-                member['role'] = roles[j] if j < len(roles) else ""
-    
-    # Assign seating
-    available_seats = SEATING_AREAS.copy()
-    random.shuffle(available_seats)
-    current_seating = available_seats[:num_groups]
+        save_json(ROLE_HISTORY_FILE, ROLE_COUNTS)
     
     # Save to history
     current_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    HISTORY.append({
-        "date": current_timestamp,
-        "num_groups": num_groups,
-        "group_size": group_size,
-        "groups": [[m['name'] for m in g] for g in current_groups]
-    })
-    save_json(HISTORY_FILE, HISTORY)
+    HISTORY.append(history_record(current_timestamp, current_groups, group_size, current_sections))
+    if not archive_history():
+        save_json(HISTORY_FILE, HISTORY)
+    index_groups()
+    record_version("Generate groups")
+    mark_state_changed()
+    notify_group_listeners()
     
     return redirect(url_for('index'))
 
+@app.route('/undo', methods=['POST'])
+@idempotent
+@profiled
+def undo():
+    if VERSION_INDEX <= 0:
+        return redirect(url_for('index', message="⚠️ Nothing to undo!"))
+    label = VERSIONS[VERSION_INDEX]['label']
+    switch_version(VERSION_INDEX - 1)
+    return redirect(url_for('index', message=f"↩️ Undid: {label}"))
+
+@app.route('/redo', methods=['POST'])
+@idempotent
+@profiled
+def redo():
+    if VERSION_INDEX >= len(VERSIONS) - 1:
+        return redirect(url_for('index', message="⚠️ Nothing to redo!"))
+    switch_version(VERSION_INDEX + 1)
+    return redirect(url_for('index', message=f"↪️ Redid: {VERSIONS[VERSION_INDEX]['label']}"))
+
+@app.route('/pick_student', methods=['POST'])
+@idempotent
+@profiled
+def pick_student():
+    name = draw_student()
+    if name is None:
+        return jsonify({"status": "error", "message": "⚠️ No students present!"})
+    save_json(PICK_HISTORY_FILE, PICK_COUNTS)
+    return jsonify({"status": "success", "name": name})
+
 @app.route('/update_settings', methods=['POST'])
+@idempotent
+@profiled
 def update_settings():
+    old_group_size = SETTINGS['group_size']
     SETTINGS['group_size'] = int(request.form.get('group_size', 4))
     SETTINGS['dark_mode'] = 'dark_mode' in request.form
     SETTINGS['balance_gender'] = 'balance_gender' in request.form
     SETTINGS['assign_roles'] = 'assign_roles' in request.form
+    SETTINGS['picker_weighted'] = 'picker_weighted' in request.form
+    SETTINGS['picker_no_repeat'] = 'picker_no_repeat' in request.form
+    SETTINGS['history_keep_records'] = int(request.form.get('history_keep_records') or 100)
+    SETTINGS['history_keep_days'] = int(request.form.get('history_keep_days') or 0)
+    SETTINGS['section_capacity'] = int(request.form.get('section_capacity') or 0)
+    SETTINGS['profile_sample_rate'] = min(1.0, max(0.0, float(request.form.get('profile_sample_rate') or 0)))
     save_json(SETTINGS_FILE, SETTINGS)
+    archive_history()
+    if SETTINGS['group_size'] != old_group_size:
+        # Which groups are open depends on the group size
+        index_groups()
+    invalidate_picker()
+    invalidate_pregenerated()
+    mark_state_changed()
     return redirect(url_for('index', message="✅ Settings saved!"))
 
 
+@app.route('/export_history')
+def export_history():
+    start = request.args.get('start', '')
+    end = request.args.get('end', '\uffff')
+    records = list(history_records(start, end))
+    return send_file(
+        BytesIO(json.dumps(records, ensure_ascii=False, indent=2).encode('utf-8')),
+        mimetype='application/json',
+        as_attachment=True,
+        download_name=f'group_history_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
+    )
+
 @app.route('/export_csv')
 def export_csv():
     if not current_groups:
@@ -996,17 +2879,18 @@ def export_csv():
     output.write('\ufeff')  # BOM for Excel UTF-8 (no need to encode)
     
     writer = csv.writer(output)
-    writer.writerow(['Group', 'Student Name', 'Role', 'Seating'])
+    writer.writerow(['Group', 'Student Name', 'Role', 'Seating'] + (['Section'] if current_sections else []))
     
     for i, group in enumerate(current_groups):
         seating = current_seating[i] if i < len(current_seating) else ""
+        section = [f"Section {current_sections[i] + 1}"] if i < len(current_sections) else []
         for member in group:
             writer.writerow([
                 f"Group {i+1}",
                 member['name'],
-                member.get('role', ''),
+                current_roles.get(member['name'], ''),
                 seating
-            ])
+            ] + section)
     
     # Convert to bytes for sending
     output.seek(0)
@@ -1017,5 +2901,105 @@ def export_csv():
         download_name=f'groups_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
     )
 
+# Headless batch mode: python app.py batch ROSTER_DIR -o OUT_DIR
+
+def read_roster(path):
+    """Read a roster file in students.json format (or the old plain list of names),
+    returns (students, restrictions)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        data = {"students": [{"name": name} for name in data]}
+    students = data.get("students", [])
+    for student in students:
+        student.setdefault("notes", "")
+        student.setdefault("absent", False)
+        student.setdefault("gender", "")
+    return students, data.get("restrictions", [])
+
+def batch_generate_roster(path, out_dir, settings, timestamp):
+    """Group one roster file, write its result and return its history record"""
+    roster = os.path.splitext(os.path.basename(path))[0]
+    students, restrictions = read_roster(path)
+    present_students = [s for s in students if not s['absent']]
+    groups, remaining, roles, seating, sections, _ = build_cohort(present_students, settings, {}, restrictions)
+    
+    save_json(os.path.join(out_dir, f"{roster}_groups.json"), {
+        "roster": roster,
+        "date": timestamp,
+        "group_size": settings['group_size'],
+        "groups": [
+            {
+                "seating": seating[i] if i < len(seating) else "",
+                "section": sections[i] if i < len(sections) else None,
+                "members": [{"name": m['name'], "role": roles.get(m['name'], '')} for m in group]
+            }
+            for i, group in enumerate(groups)
+        ],
+        "remaining": remaining
+    })
+    return dict(history_record(timestamp, groups, settings['group_size'], sections), roster=roster)
+
+def safe_batch_generate_roster(path, out_dir, settings, timestamp):
+    """batch_generate_roster that reports a bad roster instead of raising, returns (record, error)"""
+    try:
+        return batch_generate_roster(path, out_dir, settings, timestamp), None
+    except Exception as error:
+        return None, f"{path}: {type(error).__name__}: {error}"
+
+def run_batch(argv):
+    """Generate groups for every roster in a directory across a process pool"""
+    parser = argparse.ArgumentParser(prog='app.py batch', description='Generate groups for many rosters at once')
+    parser.add_argument('roster_dir', help='directory of roster .json files')
+    parser.add_argument('-o', '--out', default='batch_output', help='directory for the *_groups.json results')
+    parser.add_argument('--history', help='history file to append to (default: OUT/group_history.json)')
+    parser.add_argument('--group-size', type=int, help='override the group size from settings.json')
+    parser.add_argument('-j', '--workers', type=int, help='worker processes (default: CPU count)')
+    args = parser.parse_args(argv)
+    
+    # Read settings.json if there is one, but never create web-app files here
+    settings = dict(DEFAULT_SETTINGS)
+    if os.path.exists(SETTINGS_FILE):
+        with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
+            settings.update(json.load(f))
+    settings['solver_workers'] = 1  # the batch pool already uses every core
+    if args.group_size:
+        settings['group_size'] = args.group_size
+    
+    paths = sorted(
+        os.path.join(args.roster_dir, name) for name in os.listdir(args.roster_dir)
+        if name.endswith('.json') and not name.endswith('_groups.json')
+    )
+    if not paths:
+        print(f"No roster files found in {args.roster_dir}")
+        return 1
+    os.makedirs(args.out, exist_ok=True)
+    
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    workers = args.workers or os.cpu_count() or 1
+    chunksize = max(1, len(paths) // (4 * workers))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(
+            safe_batch_generate_roster, paths, repeat(args.out), repeat(settings), repeat(timestamp),
+            chunksize=chunksize
+        ))
+    
+    records = [record for record, error in results if record is not None]
+    errors = [error for record, error in results if error is not None]
+    
+    # One history write for the whole batch, covering every roster that succeeded
+    if records:
+        history_file = args.history or os.path.join(args.out, 'group_history.json')
+        history = load_json(history_file, [])
+        history.extend(records)
+        save_json(history_file, history)
+    
+    print(f"✅ Generated groups for {len(records)} rosters into {args.out}")
+    for error in errors:
+        print(f"⚠️ Skipped {error}", file=sys.stderr)
+    return 1 if errors else 0
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        sys.exit(run_batch(sys.argv[2:]))
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,99 @@
+"""ASGI entry point with live group updates.
+
+Serves the Flask app through asgiref and adds a Server-Sent Events stream at
+/events that pushes each new grouping to every open page. Idle subscribers
+are just a parked coroutine and a one-slot queue, so thousands of projectors
+and student devices can stay connected without a thread each.
+
+Run with:
+    pip install uvicorn asgiref
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import json
+
+from asgiref.wsgi import WsgiToAsgi
+
+import app as flask_app
+
+HEARTBEAT_SECONDS = 25  # keeps proxies from closing idle streams
+
+flask_app.LIVE_UPDATES = True
+wsgi_application = WsgiToAsgi(flask_app.app)
+
+subscribers = set()
+event_loop = None
+
+def broadcast(message):
+    """Queue an encoded event for every subscriber, dropping anything stale"""
+    for queue in subscribers:
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(message)
+
+def on_groups_changed(payload):
+    """Called from Flask worker threads after generate()"""
+    if event_loop is None or not subscribers:
+        return
+    # Encode once, share the bytes between all subscribers
+    message = f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8')
+    event_loop.call_soon_threadsafe(broadcast, message)
+
+flask_app.GROUP_LISTENERS.append(on_groups_changed)
+
+async def stream_events(receive, send):
+    """Hold one /events connection open and forward group updates to it"""
+    queue = asyncio.Queue(maxsize=1)
+    subscribers.add(queue)
+
+    async def wait_for_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    disconnect = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b': connected\n\n', 'more_body': True})
+
+        while True:
+            update = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({update, disconnect}, timeout=HEARTBEAT_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if disconnect in done:
+                update.cancel()
+                break
+            if update in done:
+                chunk = update.result()
+            else:
+                update.cancel()
+                chunk = b': keep-alive\n\n'
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    finally:
+        subscribers.discard(queue)
+        disconnect.cancel()
+
+async def application(scope, receive, send):
+    global event_loop
+    if event_loop is None:
+        event_loop = asyncio.get_running_loop()
+
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    elif scope['type'] == 'http' and scope['path'] == '/events':
+        await stream_events(receive, send)
+    else:
+        await wsgi_application(scope, receive, send)
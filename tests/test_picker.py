@@ -0,0 +1,37 @@
+import random
+
+import app
+
+
+def test_fenwick_tree_totals_and_find():
+    tree = app.FenwickTree([1, 0, 3, 2])
+    assert tree.total() == 6
+    assert [tree.find(t) for t in (0, 0.5, 1, 3.9, 4, 5.9)] == [0, 0, 2, 2, 3, 3]
+    tree.update(1, 5)
+    assert tree.total() == 11
+    assert tree.find(1) == 1
+
+
+def test_fenwick_tree_never_samples_zero_weights():
+    random.seed(3)
+    tree = app.FenwickTree([0, 2, 0, 1, 0])
+    counts = [0] * 5
+    for _ in range(3000):
+        counts[tree.sample()] += 1
+    assert counts[0] == counts[2] == counts[4] == 0
+    assert 1700 < counts[1] < 2300
+
+
+def test_no_repeat_picks_everyone_once_per_round(monkeypatch):
+    students = [{"name": name, "absent": name == "E"} for name in "ABCDE"]
+    monkeypatch.setattr(app, 'STUDENTS_DATA', {"students": students, "restrictions": []})
+    monkeypatch.setattr(app, 'SETTINGS', dict(app.DEFAULT_SETTINGS, picker_no_repeat=True))
+    monkeypatch.setattr(app, 'PICK_COUNTS', {})
+    monkeypatch.setattr(app, 'picked_this_round', set())
+    app.invalidate_picker()
+    
+    first_round = [app.draw_student() for _ in range(4)]
+    assert sorted(first_round) == ["A", "B", "C", "D"]
+    assert app.draw_student() in "ABCD"
+    assert sum(app.PICK_COUNTS.values()) == 5
+    app.invalidate_picker()
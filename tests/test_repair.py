@@ -0,0 +1,194 @@
+import random
+
+import pytest
+
+import app
+
+
+def student(name, gender=''):
+    return {"name": name, "notes": "", "absent": False, "gender": gender}
+
+
+@pytest.fixture
+def classroom(monkeypatch):
+    """Lay out a grouping in app's globals: classroom([[names], ...], remaining, restrictions)"""
+    def setup(groups, remaining=(), restrictions=(), group_size=4, sections=(), remaining_sections=(), capacity=0):
+        roster = {name: student(name) for group in groups for name in group}
+        roster.update((name, student(name)) for name in remaining)
+        monkeypatch.setattr(app, 'STUDENTS_DATA', {
+            "students": list(roster.values()),
+            "restrictions": [list(pair) for pair in restrictions]
+        })
+        monkeypatch.setattr(app, 'SETTINGS', dict(app.DEFAULT_SETTINGS, group_size=group_size, assign_roles=False,
+                                                  section_capacity=capacity))
+        monkeypatch.setattr(app, 'current_groups', [[roster[name] for name in group] for group in groups])
+        monkeypatch.setattr(app, 'current_seating', [f"Seat {i}" for i in range(len(groups))])
+        monkeypatch.setattr(app, 'current_sections', list(sections))
+        monkeypatch.setattr(app, 'current_remaining', list(remaining))
+        monkeypatch.setattr(app, 'current_remaining_sections', list(remaining_sections))
+        monkeypatch.setattr(app, 'current_roles', {})
+        app.index_groups()
+        return roster
+    return setup
+
+
+def names(groups):
+    return [sorted(m['name'] for m in group) for group in groups]
+
+
+def assert_indexes_match():
+    """The incremental indexes equal what a full rebuild would produce"""
+    assert len(app.current_seating) == len(app.current_groups)
+    expected = {m['name']: i for i, group in enumerate(app.current_groups) for m in group}
+    assert app.GROUP_INDEX == expected
+    size = app.SETTINGS['group_size']
+    assert app.OPEN_GROUPS == {i for i, g in enumerate(app.current_groups) if len(g) < size}
+    full = {}
+    for i, group in enumerate(app.current_groups):
+        if len(group) >= size:
+            full.setdefault(app.section_of(i), set()).add(i)
+    assert {section: groups for section, groups in app.FULL_GROUPS.items() if groups} == full
+    assert set(app.LEFTOVERS) == set(app.current_remaining)
+    if app.current_sections:
+        assert app.current_sections == sorted(app.current_sections)
+        assert app.LEFTOVER_SECTIONS == dict(zip(app.current_remaining, app.current_remaining_sections))
+        assert {room: count for room, count in app.SECTION_HEADCOUNT.items() if count} == headcounts()
+
+
+def test_absent_student_is_replaced_by_a_leftover(classroom):
+    roster = classroom([["A", "B", "C", "D"], ["E", "F", "G", "H"]], remaining=["X"])
+    moves = app.repair_absent(roster["B"])
+    assert moves == ["X joined Group 1"]
+    assert names(app.current_groups) == [["A", "C", "D", "X"], ["E", "F", "G", "H"]]
+    assert app.current_remaining == []
+    assert_indexes_match()
+
+
+def test_replacement_avoids_restricted_partners(classroom):
+    roster = classroom([["A", "B", "C", "D"]], remaining=["X", "Y"], restrictions=[("A", "X")])
+    app.repair_absent(roster["B"])
+    assert names(app.current_groups) == [["A", "C", "D", "Y"]]
+    assert app.current_remaining == ["X"]
+    assert_indexes_match()
+
+
+def test_one_absence_without_leftovers_leaves_a_short_group(classroom):
+    roster = classroom([["A", "B", "C", "D"], ["E", "F", "G", "H"]])
+    assert app.repair_absent(roster["A"]) == []
+    assert names(app.current_groups) == [["B", "C", "D"], ["E", "F", "G", "H"]]
+    assert_indexes_match()
+
+
+def test_second_absence_borrows_from_a_full_group(classroom):
+    roster = classroom([["A", "B", "C", "D"], ["E", "F", "G", "H"], ["I", "J", "K", "L"]])
+    app.repair_absent(roster["A"])
+    moves = app.repair_absent(roster["B"])
+    assert len(moves) == 1 and "to Group 1" in moves[0]
+    assert sorted(len(group) for group in app.current_groups) == [3, 3, 4]
+    assert_indexes_match()
+
+
+def test_lone_member_is_folded_in_and_later_groups_shift(classroom):
+    roster = classroom([["A", "B"], ["C", "D"], ["E", "F"], ["G"]], group_size=2)
+    app.repair_absent(roster["C"])
+    # D was alone, so Group 2 is gone and D joined the open group (G's)
+    assert names(app.current_groups) == [["A", "B"], ["E", "F"], ["D", "G"]]
+    assert app.current_seating == ["Seat 0", "Seat 2", "Seat 3"]
+    assert_indexes_match()
+
+
+def test_present_student_fills_the_smallest_open_group(classroom):
+    roster = classroom([["A", "B", "C"], ["D", "E"], ["F", "G", "H", "I"]])
+    roster["X"] = student("X")
+    assert app.repair_present(roster["X"]) == ["X joined Group 2"]
+    assert_indexes_match()
+
+
+def test_enough_leftovers_form_a_new_group(classroom):
+    roster = classroom([["A", "B", "C", "D"]], remaining=["W", "X", "Y"])
+    moves = app.repair_present(student("Z"))
+    assert moves == ["New Group 2 formed from the remaining students"]
+    assert names(app.current_groups)[1] == ["W", "X", "Y", "Z"]
+    assert app.current_remaining == []
+    assert_indexes_match()
+
+
+def test_sectioned_repair_ignores_leftovers_in_other_rooms(classroom):
+    roster = classroom([["A", "B", "C", "D"], ["E", "F", "G", "H"]], remaining=["X"],
+                       sections=[0, 1], remaining_sections=[1])
+    assert app.repair_absent(roster["B"]) == []
+    assert names(app.current_groups) == [["A", "C", "D"], ["E", "F", "G", "H"]]
+    assert app.current_remaining == ["X"]
+    assert_indexes_match()
+
+
+def test_sectioned_repair_borrows_within_the_room(classroom):
+    roster = classroom([["A", "B", "C", "D"], ["E", "F", "G", "H"], ["I", "J", "K", "L"]],
+                       sections=[0, 1, 1])
+    app.repair_absent(roster["E"])
+    app.repair_absent(roster["F"])
+    assert names(app.current_groups)[0] == ["A", "B", "C", "D"]
+    assert sorted(len(group) for group in app.current_groups[1:]) == [3, 3]
+    assert_indexes_match()
+
+
+def test_sectioned_new_group_joins_its_room(classroom):
+    classroom([["A", "B", "C", "D"], ["E", "F", "G", "H"]], remaining=["W", "X", "Y"],
+              sections=[0, 1], remaining_sections=[0, 0, 0])
+    moves = app.repair_present(student("Z"))
+    assert moves == ["New Group 2 formed from the remaining students"]
+    assert names(app.current_groups) == [["A", "B", "C", "D"], ["W", "X", "Y", "Z"], ["E", "F", "G", "H"]]
+    assert app.current_sections == [0, 0, 1]
+    assert app.current_seating[1] != app.current_seating[0]
+    assert_indexes_match()
+
+
+def test_sectioned_lone_member_stays_in_their_room(classroom):
+    roster = classroom([["A", "B"], ["C", "D"], ["E"]], group_size=2, sections=[0, 0, 1])
+    app.repair_absent(roster["A"])
+    # B can't join E's open group in the other room, so B waits in room 0
+    assert names(app.current_groups) == [["C", "D"], ["E"]]
+    assert app.current_sections == [0, 1]
+    assert app.current_remaining == ["B"] and app.current_remaining_sections == [0]
+    assert_indexes_match()
+
+
+def headcounts():
+    counts = {}
+    for i, group in enumerate(app.current_groups):
+        counts[app.current_sections[i]] = counts.get(app.current_sections[i], 0) + len(group)
+    for section in app.current_remaining_sections:
+        counts[section] = counts.get(section, 0) + 1
+    return counts
+
+
+def test_newcomers_go_to_rooms_with_free_seats(classroom):
+    classroom([["A", "B", "C"], ["D", "E", "F"], ["G", "H", "I"], ["J", "K", "L"]], remaining=["M"],
+              group_size=3, sections=[0, 0, 1, 1], remaining_sections=[0], capacity=7)
+    app.repair_present(student("N"))
+    assert headcounts() == {0: 7, 1: 7}
+    assert app.LEFTOVER_SECTIONS["N"] == 1
+    assert_indexes_match()
+
+
+def test_sections_stay_within_capacity_through_repairs(monkeypatch):
+    random.seed(7)
+    students = [student(f"S{i}", "MF"[i % 2]) for i in range(70)]
+    monkeypatch.setattr(app, 'STUDENTS_DATA', {"students": students, "restrictions": []})
+    monkeypatch.setattr(app, 'SETTINGS', dict(app.DEFAULT_SETTINGS, group_size=3, assign_roles=False,
+                                              section_capacity=20))
+    cohort = app.build_cohort(students, app.SETTINGS, {})
+    for name, value in zip(['current_groups', 'current_remaining', 'current_roles', 'current_seating',
+                            'current_sections', 'current_remaining_sections'], cohort):
+        monkeypatch.setattr(app, name, value)
+    app.index_groups()
+    
+    for _ in range(2000):
+        chosen = random.choice(students)
+        chosen['absent'] = not chosen['absent']
+        if chosen['absent']:
+            app.repair_absent(chosen)
+        else:
+            app.repair_present(chosen)
+        assert max(headcounts().values()) <= 20
+    assert_indexes_match()
@@ -0,0 +1,27 @@
+import random
+from itertools import permutations
+
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_min_cost_assignment_is_optimal(seed):
+    rng = random.Random(seed)
+    n = rng.randint(1, 6)
+    cost = [[rng.randint(0, 20) for _ in range(n)] for _ in range(n)]
+    result = app.min_cost_assignment(cost)
+    assert sorted(result) == list(range(n))
+    best = min(sum(cost[row][col] for row, col in enumerate(cols)) for cols in permutations(range(n)))
+    assert sum(cost[row][col] for row, col in enumerate(result)) == best
+
+
+def test_assign_roles_rotates_towards_least_held_roles():
+    group = [{"name": name} for name in ("A", "B", "C", "D")]
+    role_counts = {"A": {"Leader": 3}, "B": {"Note-taker": 2, "Presenter": 2, "Timekeeper": 2}}
+    roles = app.assign_roles([group], role_counts)
+    assert roles["B"] == "Leader"
+    assert roles["A"] != "Leader"
+    assert sorted(roles.values()) == sorted(app.GROUP_ROLES)
+    assert role_counts["B"]["Leader"] == 1
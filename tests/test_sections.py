@@ -0,0 +1,31 @@
+import random
+
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize("count,capacity,group_size", [(120, 30, 4), (61, 25, 4), (50, 50, 3), (9, 4, 5)])
+def test_split_sections_deals_everyone_in_whole_groups(count, capacity, group_size):
+    students = [{"name": f"S{i}", "gender": "MF"[i % 2]} for i in range(count)]
+    sections = app.split_sections(students, capacity, group_size)
+    dealt = [s['name'] for section in sections for s in section]
+    assert sorted(dealt) == sorted(s['name'] for s in students)
+    if capacity >= group_size:
+        assert all(len(section) <= capacity for section in sections)
+    # Only the cohort's own remainder may be left over
+    assert sum(len(section) // group_size for section in sections) == count // group_size
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_split_sections_spreads_restricted_students(seed):
+    random.seed(seed)
+    students = [{"name": f"S{i}", "gender": "MF"[i % 2]} for i in range(120)]
+    clique = [f"S{i}" for i in range(20)]
+    restrictions = [[a, b] for i, a in enumerate(clique) for b in clique[i + 1:]]
+    sections = app.split_sections(students, 30, 4, restrictions)
+    for section in sections:
+        # No more of them than the section has groups, so they can be kept apart
+        assert sum(s['name'] in clique for s in section) <= len(section) // 4
+        genders = [s['gender'] for s in section]
+        assert abs(genders.count("M") - genders.count("F")) <= 2